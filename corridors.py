@@ -0,0 +1,121 @@
+# Corridor contraction: most stops are interior stops of a line, with exactly two neighbours in the network. A route
+# passes through them on its way between the stops around them, so they are taken out of the TSP instance and put
+# back into the route afterwards from the predecessor table.
+#
+# - a chain of such stops leading to a terminal (degree 1) is passed through on the way to the terminal, only the
+#   terminal is kept
+# - a chain between two junctions is kept as its two end stops joined by a fixed edge, a corridor the route has to
+#   run through.  The edge is fixed by adding half the `penalty` to every other edge at an end of a corridor: a tour
+#   pays it twice at every end, once less for every corridor it runs through, and `offset` gives back the cost of
+#   its route
+
+import numpy as np
+
+import graph
+
+
+# neighbours of every stop from the edge arrays of the network
+def adjacency(frm, to, count):
+    neighbours = [[] for _ in range(count)]
+
+    for i, j in zip(frm, to):
+        if i != j and j not in neighbours[i]:
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+
+    return neighbours
+
+
+# maximal chains of degree-2 stops as (first end, interior stops in order, last end), the ends are the stops of
+# other degrees around the chain.  Stops on a cycle without any other stop are left out
+def chains(neighbours):
+    seen = set()
+    out = []
+
+    for start, around in enumerate(neighbours):
+        if len(around) == 2:
+            continue
+
+        for node in around:
+            if len(neighbours[node]) != 2 or node in seen:
+                continue
+
+            previous, interior = start, []
+            while len(neighbours[node]) == 2 and node not in seen:
+                seen.add(node)
+                interior.append(node)
+                first, second = neighbours[node]
+                previous, node = node, second if first == previous else first
+
+            out.append((start, interior, node))
+
+    return out
+
+
+class Contraction:
+    # dist, pred: all-pairs tables of the network, frm, to: its edges
+    # minimum: shortest chain between two junctions turned into a corridor, a corridor saves minimum - 2 stops
+    def __init__(self, dist, pred, frm, to, minimum=3):
+        dist = np.asarray(dist, dtype=float)
+        count = len(dist)
+        neighbours = adjacency(frm, to, count)
+        removed = set()
+        corridors = []
+
+        for first, interior, last in chains(neighbours):
+            # dead end, every way to the terminal runs through the whole chain
+            if len(neighbours[last]) == 1 or len(neighbours[first]) == 1:
+                terminal, other = (last, first) if len(neighbours[last]) == 1 else (first, last)
+                if set(interior) <= set(graph.walk_predecessors(pred[other], other, terminal)):
+                    removed.update(interior)
+
+            # corridor between junctions, only if it is the shortest way between its ends
+            elif len(interior) >= minimum and \
+                    graph.walk_predecessors(pred[interior[0]], interior[0], interior[-1]) == interior:
+                removed.update(interior[1:-1])
+                corridors.append((interior[0], interior[-1]))
+
+        self.dist = dist
+        self.pred = pred
+        self.removed = removed
+        # stops of the reduced instance, its node i is the stop nodes[i]
+        self.nodes = [node for node in range(count) if node not in removed]
+        position = {node: i for i, node in enumerate(self.nodes)}
+        self.corridors = [(position[i], position[j]) for i, j in corridors]
+
+        # larger than the cost of any route, a tour leaving out a corridor is never shorter
+        self.penalty = count * float(dist.max() if count else 0.) + 1.
+        ends = np.zeros(len(self.nodes))
+        ends[[i for corridor in self.corridors for i in corridor]] = self.penalty / 2
+        self.matrix = dist[np.ix_(self.nodes, self.nodes)] + ends[:, None] + ends[None, :]
+        np.fill_diagonal(self.matrix, 0.)
+        for i, j in self.corridors:
+            self.matrix[i, j] = self.matrix[j, i] = dist[self.nodes[i], self.nodes[j]]
+
+        # cost of a tour of the instance minus the cost of its route, when it runs through every corridor
+        self.offset = self.penalty * len(self.corridors)
+
+    # route over every stop from a tour of the reduced instance: the removed stops are put back in the order the
+    # shortest paths between the stops of the tour pass through them, any stop left (a corridor the tour does not
+    # run through) is inserted where it costs the least
+    def expand(self, tour):
+        dist = self.dist
+        stops = [self.nodes[i] for i in tour]
+        placed = set(stops)
+        route = []
+
+        for i, stop in enumerate(stops):
+            route.append(stop)
+            following = stops[(i + 1) % len(stops)]
+
+            for node in graph.walk_predecessors(self.pred[stop], stop, following)[1:-1]:
+                if node in self.removed and node not in placed:
+                    route.append(node)
+                    placed.add(node)
+
+        for node in sorted(self.removed - placed):
+            costs = [dist[route[i - 1], node] + dist[node, route[i]] - dist[route[i - 1], route[i]]
+                     for i in range(len(route))]
+            route.insert(int(np.argmin(costs)), node)
+
+        return route
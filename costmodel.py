@@ -0,0 +1,84 @@
+# Vectorized travel time model, distances are computed for whole edge lists at once
+#
+# Error bounds against geopy.distance.distance (Karney geodesic on WGS-84), measured
+# on every station pair of metro_stations.csv (up to ~30 km apart):
+#  - "ellipsoidal" (Lambert's formula on WGS-84): below 5 cm, far below the precision of the
+#    station coordinates. The bound only holds at metro scale: it grows with the distance, about
+#    13 m up to 10,000 km and 0.4 km up to 19,000 km, and near-antipodal pairs, where Lambert's
+#    formula breaks down, are off by up to ~30 km (random pairs around the globe: up to a few km)
+#  - "haversine" (sphere with mean radius 6371.0088 km): below 0.5% (about 120 m at 30 km),
+#    close to the worst case of the spherical model anywhere on Earth (~0.55%)
+#  - "geodesic": geopy itself, one call per pair, exact but slow
+
+import numpy as np
+
+# WGS-84 ellipsoid
+EQUATORIAL_RADIUS_KM = 6378.137
+FLATTENING = 1 / 298.257223563
+MEAN_RADIUS_KM = 6371.0088
+
+METHODS = ("ellipsoidal", "haversine", "geodesic")
+
+
+# central angle (radians) between two points given in radians
+def centralAngle(lat1, lng1, lat2, lng2):
+    h = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2.0) ** 2
+    return 2.0 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+# great circle distance in km on a sphere with the mean Earth radius
+def haversine(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lng1, lat2, lng2))
+    return MEAN_RADIUS_KM * centralAngle(lat1, lng1, lat2, lng2)
+
+
+# distance in km on the WGS-84 ellipsoid with Lambert's formula
+def ellipsoidal(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lng1, lat2, lng2))
+
+    # reduced latitudes
+    b1 = np.arctan((1.0 - FLATTENING) * np.tan(lat1))
+    b2 = np.arctan((1.0 - FLATTENING) * np.tan(lat2))
+    sigma = centralAngle(b1, lng1, b2, lng2)
+
+    p = (b1 + b2) / 2.0
+    q = (b2 - b1) / 2.0
+
+    # identical points give 0 / 0, the correction is 0 there
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (sigma - np.sin(sigma)) * (np.sin(p) * np.cos(q)) ** 2 / np.cos(sigma / 2.0) ** 2
+        y = (sigma + np.sin(sigma)) * (np.cos(p) * np.sin(q)) ** 2 / np.sin(sigma / 2.0) ** 2
+    correction = np.where(sigma > 0, x + y, 0.0)
+
+    return EQUATORIAL_RADIUS_KM * (sigma - FLATTENING / 2.0 * correction)
+
+
+# exact geodesic distance in km, one geopy call per pair
+def geodesic(lat1, lng1, lat2, lng2):
+    import geopy.distance
+
+    pairs = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (lat1, lng1, lat2, lng2)))
+    out = np.empty(pairs[0].shape)
+    for i, (a, b, c, d) in enumerate(zip(*(x.ravel() for x in pairs))):
+        out.flat[i] = geopy.distance.distance((a, b), (c, d)).km
+
+    return out
+
+
+def distanceKm(lat1, lng1, lat2, lng2, method="ellipsoidal"):
+    if method == "ellipsoidal":
+        return ellipsoidal(lat1, lng1, lat2, lng2)
+    elif method == "haversine":
+        return haversine(lat1, lng1, lat2, lng2)
+    elif method == "geodesic":
+        return geodesic(lat1, lng1, lat2, lng2)
+    else:
+        raise ValueError("unknown distance method {!r}, expected one of {}".format(method, METHODS))
+
+
+# estimated minutes to travel between stops, if not same line add some time to change and wait for new train
+def estimatedMins(distKm, sameLine, averageSpeed=35.0, averageWalkSpeed=5.0, switchMins=3.0):
+    distKm = np.asarray(distKm, dtype=float)
+    return np.where(sameLine,
+                    (distKm / averageSpeed) * 60.0,
+                    (distKm / averageWalkSpeed) * 60.0 + switchMins)
@@ -1,4 +1,4 @@
-import numpy as np
+import heapq
 
 class Vertex:
     def __init__(self, node):
@@ -20,6 +20,7 @@ class Vertex:
 class Graph:
     def __init__(self):
         self.vert_dict = {}
+        self.predecessors = {}
 
     def __iter__(self):
         return iter(self.vert_dict.values())
@@ -44,43 +45,83 @@ class Graph:
         self.vert_dict[frm].set_neighbor(self.vert_dict[to], cost)
         self.vert_dict[to].set_neighbor(self.vert_dict[frm], cost)
 
+        # cached shortest paths are stale once the graph changes
+        self.predecessors = {}
+
+    # adds many edges at once, e.g. the edge arrays of a loader, the path cache is reset only once
+    def add_edges(self, frm, to, costs):
+        vert_dict = self.vert_dict
+
+        for i, j, cost in zip(frm, to, costs):
+            if i not in vert_dict:
+                vert_dict[i] = Vertex(i)
+            if j not in vert_dict:
+                vert_dict[j] = Vertex(j)
+
+            vert_dict[i].adjacent[vert_dict[j]] = cost
+            vert_dict[j].adjacent[vert_dict[i]] = cost
+
+        self.predecessors = {}
+
     def get_vertices(self):
         return self.vert_dict.keys()
 
-    # get vertex with minimum distance
-    def minDistance(self, dist, sptSet): 
-  
-        min = None
-  
-        # Search nearest vertex not yet in the shortest path set
-        for v in self.vert_dict.values(): 
-            if dist[v.get_id()] != None and (min == None or dist[v.get_id()] < min) and not sptSet[v.get_id()]: 
-                min = dist[v.get_id()] 
-                min_index = v.get_id()
-  
-        return self.vert_dict[min_index]
-
-    # searches shortest paths from start node to all other nodes
-    def dijkstra(self, start): 
-  
-        dist = { key: None for key in [*self.vert_dict] }
-        path = { key: [] for key in [*self.vert_dict] }
-        dist[start] = 0
-        path[start] = []
-        sptSet = { key: False for key in [*self.vert_dict] }
-  
-        # repeat until all shortest paths have been found
-        while not np.all(list(sptSet.values())): 
-  
-            # closest node not yet finished
-            u = self.minDistance(dist, sptSet) 
-   
-            sptSet[u.get_id()] = True
-   
-            for v in u.get_connections(): 
-                cost = u.get_weight(v)
-                if dist[v.get_id()] == None or dist[v.get_id()] > dist[u.get_id()] + cost: 
-                    dist[v.get_id()] = dist[u.get_id()] + cost
-                    path[v.get_id()] = path[u.get_id()] + [u.get_id()]
-
-        return dist, path
\ No newline at end of file
+    # searches shortest paths from start node to all other nodes, the graph keeps nothing of the search
+    def dijkstra(self, start):
+
+        dist = { start: 0 }
+        pred = { start: None }
+        done = set()
+        heap = [(0, 0, start)]
+        counter = 1
+
+        # pop the closest node not yet finished, stale heap entries are skipped
+        while heap:
+            d, _, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+
+            for v, cost in self.vert_dict[u].adjacent.items():
+                v = v.get_id()
+                alt = d + cost
+                if v not in dist or alt < dist[v]:
+                    dist[v] = alt
+                    pred[v] = u
+                    # counter breaks ties so vertex ids never get compared
+                    heapq.heappush(heap, (alt, counter, v))
+                    counter += 1
+
+        # unreachable vertices keep no distance
+        for key in self.vert_dict:
+            if key not in dist:
+                dist[key] = None
+                pred[key] = None
+
+        return dist, pred
+
+    # rebuilds the path from src to dst (both included) from the predecessors of src, only the searches of
+    # reconstructed paths are cached: an all-pairs build would otherwise keep n dicts of n entries
+    def reconstruct_path(self, src, dst):
+        if src not in self.predecessors:
+            self.predecessors[src] = self.dijkstra(src)[1]
+        return walk_predecessors(self.predecessors[src], src, dst)
+
+
+# follows a predecessor mapping (or array row) back from dst to src
+def walk_predecessors(pred, src, dst):
+    if src == dst:
+        return [src]
+
+    path = [dst]
+    node = pred[dst]
+    while node is not None and node != -1 and node != src:
+        path.append(node)
+        node = pred[node]
+
+    if node != src:
+        return []
+
+    path.append(src)
+    path.reverse()
+    return path
@@ -1,86 +1,404 @@
 # Data from https://datos.cdmx.gob.mx/explore/dataset/estaciones-metro/table/
 # Best Python LKH implementation from https://arthur.maheo.net/implementing-lin-kernighan-in-python/
 # Dijkstra implementation adapted from https://www.geeksforgeeks.org/python-program-for-dijkstras-shortest-path-algorithm-greedy-algo-7/
+#
+# Usage: python index.py [build-matrix | solve | report | bench] [options], solve if no command is given.
+# Importing this module has no side effects, heavy dependencies (pandas, numpy, the solvers) are only
+# imported by the commands that need them.
 
-import pandas as pd 
-import numpy as np
-import geopy.distance
-import graph
+import argparse
+import json
+import sys
+import time
 
-from tsp_local.base import TSP
-from tsp_local.kopt import KOpt
+# cost model, part of the key of the cached matrices
+stationsFile = "metro_stations.csv"
+method = "ellipsoidal"
+averageSpeed = 35.0
+averageWalkSpeed = 5.0
+switchMins = 3.0
+walkRadiusKm = 0.0  # walks between different stations closer than this, none if 0
 
-# calculates estimated time to travel from stop 1 to 2
-# if not same line add some time to change and wait for new train
-def calculateEstimatedMins(s1, s2):
+# reads station info into one array per column: ID,Name,Lat,Lng,LineID
+def loadStations(path=stationsFile):
+    import stations
 
-    averageSpeed = 35.0
-    averageWalkSpeed = 5.0
-    switchMins = 3.0
+    return stations.readStations(path)
 
-    ll1 = (float(s1["Lat"]), float(s1["Lng"]))
-    ll2 = (float(s2["Lat"]), float(s2["Lng"]))
-    sameLine = s1["LineID"] == s2["LineID"]
-    distKm = geopy.distance.distance(ll1, ll2).km
 
-    if sameLine:
-        return (distKm / averageSpeed) * 60.0
-    else:
-        return (distKm / averageWalkSpeed) * 60.0 + switchMins
-
-
-# read station info
-data = pd.read_csv("metro_stations.csv") #ID,Name,Lat,Lng,LineID
-station_count = data.shape[0]
-
-# create graph for distance calculation
-g = graph.Graph()
-
-# adds vertices / edges with calculated cost (estimated time) - simple edges of same line
-for index, stop in data.iterrows():
-    if index < station_count - 1:
-        nextStop = data.iloc[index + 1]
-        if nextStop["LineID"] == stop["LineID"]:
-            g.add_edge(index, index + 1, calculateEstimatedMins(stop, nextStop))
-
-# adds vertices / edges with calculated cost (estimated time) -  edges to connect to other lines
-for index, stop in data.iterrows():
-    mask = data['Name'] == stop["Name"]
-    if np.count_nonzero(mask) > 1:
-        indices = np.where(mask)[0]
-        for otherIndex in indices:
-            if otherIndex < index:
-                sameStop = data.iloc[otherIndex]
-                g.add_edge(index, otherIndex, calculateEstimatedMins(stop, sameStop))
-
-# calculate complete distance / path table
-dist = np.zeros((station_count, station_count))
-distPath = np.empty((station_count, station_count), dtype=object)
-for v in g:
-    distances, paths = g.dijkstra(v.get_id())
-    for id, cost in distances.items():
-        dist[v.get_id()][id] = cost
-    for id, p in paths.items():
-        distPath[v.get_id()][id] = p
+# calculates estimated time to travel between the stops of whole edge lists (index arrays into data)
+# method: "ellipsoidal" (default), "haversine" or "geodesic" for the exact but slow geopy distance
+def calculateEstimatedMins(data, frm, to, method=method, averageSpeed=averageSpeed,
+                           averageWalkSpeed=averageWalkSpeed, switchMins=switchMins):
+    import costmodel
+
+    lat = data["Lat"]
+    lng = data["Lng"]
+    line = data["LineID"]
+
+    distKm = costmodel.distanceKm(lat[frm], lng[frm], lat[to], lng[to], method)
+    return costmodel.estimatedMins(distKm, line[frm] == line[to], averageSpeed, averageWalkSpeed, switchMins)
+
+
+# edges of same line neighbours, to connect to other lines and to walk to stations closer than walkRadiusKm
+def networkEdges(data, walkRadiusKm=walkRadiusKm, method=method):
+    import stations
+
+    return stations.stationEdges(data, walkRadiusKm, method)
+
+
+# network of the stations, every edge costs its estimated time (walks are priced as transfers)
+def buildGraph(data, walkRadiusKm=walkRadiusKm, **model):
+    import graph
+
+    g = graph.Graph()
+    frm, to = networkEdges(data, walkRadiusKm, model.get("method", method))
+
+    # adds vertices / edges with calculated cost (estimated time)
+    g.add_edges(frm.tolist(), to.tolist(), calculateEstimatedMins(data, frm, to, **model).tolist())
+    return g
+
+
+# builds the graph and the complete distance / predecessor table, pred[s][v] is the node before v on the way from s (-1 if none)
+# and dist[s][v] is NaN if v can not be reached from s
+def buildMatrices(data, **model):
+    import numpy as np
+
+    station_count = len(data["ID"])
+    g = buildGraph(data, **model)
+
+    dist = np.zeros((station_count, station_count))
+    pred = np.full((station_count, station_count), -1, dtype=np.int32)
+    for v in g:
+        distances, predecessors = g.dijkstra(v.get_id())
+        for id, cost in distances.items():
+            dist[v.get_id()][id] = np.nan if cost is None else cost
+        for id, p in predecessors.items():
+            if p is not None:
+                pred[v.get_id()][id] = p
+
+    return dist, pred
+
+
+# all-pairs tables for a station file and cost model, cached on disk so later runs memory-map them
+def loadMatrices(data, path=stationsFile, cache=True, **model):
+    import matrixcache
+
+    model = dict(dict(method=method, averageSpeed=averageSpeed, averageWalkSpeed=averageWalkSpeed,
+                      switchMins=switchMins, walkRadiusKm=walkRadiusKm), **model)
+
+    if not cache:
+        return buildMatrices(data, **model)
+
+    return matrixcache.cached(path, lambda: buildMatrices(data, **model), **model)
+
+
+# same tables as buildMatrices, but a row is only computed (one Dijkstra search) the first time it is read
+def lazyMatrices(data, **model):
+    from tsp_local.store import LazyStore
+
+    station_count = len(data["ID"])
+    g = buildGraph(data, **model)
+    searches = {}
+
+    def search(start):
+        if start not in searches:
+            searches[start] = g.dijkstra(start)
+        return searches[start]
+
+    # unreachable stations are NaN as in buildMatrices, a zero would look like a free edge to the searches
+    def distances(start):
+        row = search(start)[0]
+        return [float("nan") if row[v] is None else row[v] for v in range(station_count)]
+
+    def predecessors(start):
+        row = search(start)[1]
+        return [-1 if row[v] is None else row[v] for v in range(station_count)]
+
+    return LazyStore(station_count, distances), LazyStore(station_count, predecessors, "i")
+
 
 # use TSP algorithm
-TSP.setEdges(dist)
-lk = KOpt(list(range(station_count)))
-result, cost = lk.optimise()
+# independent LK searches from a greedy and random starting tours, one per CPU
+# record: instrument the searches (counters and JSON-lines events), profile: "cpu" or "memory"
+# timeLimit: seconds until the searches stop with their best tour so far
+# checkpoints: directory where the searches save themselves, and resume from when run again
+# kinds: starting tours of the first and of the other searches, coordinates: (lat, lng) for the "hilbert" starts
+# gap: the searches stop once within this fraction of the lower bound (Held-Karp, computed if not given)
+# kicks: iterated Lin-Kernighan, every search goes on with this many double-bridge kicks from its local optimum
+# contraction: corridors.Contraction of dist, the searches run on its smaller instance and the route is expanded
+# clusters: stops of every station, the route visits one stop of each (generalised TSP), see stationClusters
+# store: distance store of the searches, "flat", "quantised" (int32) or "dense", see tsp_local.store
+# polish: finish every search with a vectorised 2-opt pass over candidate neighbours
+def solve(dist, starts=None, workers=None, seed=0, record=False, profile=None, timeLimit=None, checkpoints=None,
+          kinds=("greedy", "nearest"), coordinates=None, gap=None, bound=None, kicks=None, contraction=None,
+          clusters=None, store="flat", polish=False):
+    import numpy as np
+    from tsp_local.clusters import ClusterSearch
+    from tsp_local.iterated import IteratedKOpt
+    from tsp_local.kopt import KOpt
+    from tsp_local.multistart import multiStart
+
+    solver, solverOptions = (IteratedKOpt, {"kicks": kicks}) if kicks else (KOpt, None)
+
+    if clusters is not None:
+        # the lower bound is for routes over every stop, the corridors and the checkpoints for the stop searches
+        if gap is not None or bound is not None or contraction is not None or checkpoints is not None:
+            raise ValueError("clusters do not work with a gap, a bound, a contraction or checkpoints")
+
+        solver, solverOptions = ClusterSearch, dict(solverOptions or {}, solver=solver, clusters=clusters)
+
+    if contraction is None:
+        return multiStart(dist, starts=starts, workers=workers, seed=seed, solver=solver, record=record,
+                          profile=profile, timeLimit=timeLimit, checkpoints=checkpoints, kinds=kinds,
+                          coordinates=coordinates, gap=gap, bound=bound, solverOptions=solverOptions, store=store,
+                          polish=polish)
+
+    # costs of the reduced instance are the route costs plus its offset, the gap is taken on the route costs
+    offset = contraction.offset
+    if gap is not None:
+        bound = lowerBound(dist) if bound is None else bound
+        gap = gap * abs(bound) / abs(bound + offset)
+    if coordinates is not None:
+        coordinates = coordinates[contraction.nodes]
+
+    result, _, stats = multiStart(contraction.matrix, starts=starts, workers=workers, seed=seed, solver=solver,
+                                  record=record, profile=profile, timeLimit=timeLimit, checkpoints=checkpoints,
+                                  kinds=kinds, coordinates=coordinates, gap=gap,
+                                  bound=None if bound is None else bound + offset, solverOptions=solverOptions,
+                                  store=store, polish=polish)
+
+    for search in stats:
+        search["cost"] -= offset
+        search["initial_cost"] -= offset
+        if bound is not None:
+            search["gap"] = (search["cost"] - bound) / abs(bound)
+
+    # the cost of the expanded route, without the rounding of the offset
+    route = contraction.expand(result)
+    return route, float(np.asarray(dist)[route, np.roll(route, -1)].sum()), stats
+
+
+# one cluster per station name, the stops of a transfer station on every line
+def stationClusters(data):
+    import stations
+
+    return [group.tolist() for group in stations.nameGroups(data["Name"])]
+
+
+# corridors of the network (chains of stops with two neighbours) taken out of the instance, see corridors.py
+def contract(data, dist, pred, walkRadiusKm=walkRadiusKm, method=method):
+    import corridors
+
+    frm, to = networkEdges(data, walkRadiusKm, method)
+    return corridors.Contraction(dist, pred, frm, to)
+
+
+# Held-Karp lower bound of the route length, no route can be shorter
+def lowerBound(dist):
+    from tsp_local.bound import HeldKarp
+
+    return HeldKarp(dist).bound
+
+
+def coordinates(data):
+    import numpy as np
+
+    return np.column_stack((data["Lat"], data["Lng"]))
+
+
+# prints the route with the stations passed through between visits and its total time
+def report(data, dist, pred, result, out=sys.stdout):
+    import graph
+
+    names = data["Name"]
+    lines = data["LineID"]
+    total = 0
+
+    for i, index in enumerate(result):
+        currentName = names[index] + ' ' + lines[index]
+        nextIndex = result[(i + 1) % len(result)]
+        total += dist[index][nextIndex]
+
+        print(currentName, file=out)
+
+        for p in graph.walk_predecessors(pred[index], index, nextIndex):
+            if p != index and p != nextIndex:
+                name = names[p] + ' ' + lines[p]
+                print(">", name, file=out)
+
+    print(total, file=out)
+    return total
+
+
+def modelArguments(args):
+    return dict(method=args.method, averageSpeed=args.average_speed,
+                averageWalkSpeed=args.walk_speed, switchMins=args.switch_mins, walkRadiusKm=args.walk_radius)
+
+
+def buildMatrixCommand(args):
+    import matrixcache
+
+    data = loadStations(args.stations)
+    model = modelArguments(args)
+    dist, pred = buildMatrices(data, **model)
+
+    if args.cache:
+        key = matrixcache.cacheKey(args.stations, **model)
+        matrixcache.save(key, dist, pred)
+        print(key)
+
+
+def solveCommand(args):
+    data = loadStations(args.stations)
+    dist, pred = loadMatrices(data, args.stations, args.cache, **modelArguments(args))
+    record = args.events is not None or args.profile is not None
+    bound = lowerBound(dist) if args.bound or args.gap is not None else None
+    result, cost, stats = solve(dist, args.starts, args.workers, args.seed, record, args.profile,
+                                args.time_limit, args.checkpoints, args.kinds, coordinates(data), args.gap, bound,
+                                args.kicks, contract(data, dist, pred, args.walk_radius, args.method) if args.contract else None,
+                                stationClusters(data) if args.clusters else None, args.store, args.polish)
+
+    # one JSON object per line, tagged with the search it comes from
+    if record:
+        with open(args.events or "events.jsonl", "w") as f:
+            for search in stats:
+                for event in search.pop("events"):
+                    f.write(json.dumps(dict(event, start=search["start"])) + "\n")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"route": [int(i) for i in result], "cost": cost, "bound": bound, "stats": stats}, f, indent=2)
+
+    report(data, dist, pred, result)
+
+    if bound is not None:
+        print("lower bound {:.3f}, gap {:.2%}".format(bound, (cost - bound) / bound))
+
+
+# without the cache only the rows of the stops of the route are computed
+def reportCommand(args):
+    data = loadStations(args.stations)
+    if args.cache:
+        dist, pred = loadMatrices(data, args.stations, **modelArguments(args))
+    else:
+        dist, pred = lazyMatrices(data, **modelArguments(args))
+
+    with open(args.route) as f:
+        result = json.load(f)["route"]
+
+    report(data, dist, pred, result)
+
+
+# times every stage of the pipeline, with --no-cache the matrices are rebuilt every run
+def benchCommand(args):
+    timings = {"load": [], "matrix": [], "solve": []}
+    costs = []
+
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        data = loadStations(args.stations)
+        timings["load"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        dist, pred = loadMatrices(data, args.stations, args.cache, **modelArguments(args))
+        timings["matrix"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        result, cost, stats = solve(dist, args.starts, args.workers, args.seed, kinds=args.kinds,
+                                    coordinates=coordinates(data), kicks=args.kicks,
+                                    contraction=contract(data, dist, pred, args.walk_radius, args.method) if args.contract else None,
+                                    clusters=stationClusters(data) if args.clusters else None, store=args.store,
+                                    polish=args.polish)
+        timings["solve"].append(time.perf_counter() - started)
+        costs.append(cost)
+
+    for stage, seconds in timings.items():
+        print("{:<8}{:10.4f}s best {:10.4f}s mean".format(stage, min(seconds), sum(seconds) / len(seconds)))
+    print("{:<8}{:10.4f}  best {:10.4f}  mean".format("cost", min(costs), sum(costs) / len(costs)))
+
+
+# options of solve which --clusters does not work with, see solve
+clusterConflicts = (("--gap", "gap"), ("--bound", "bound"), ("--contract", "contract"),
+                    ("--checkpoints", "checkpoints"))
+
+
+def parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--stations", default=stationsFile, help="station file (ID,Name,Lat,Lng,LineID)")
+    common.add_argument("--method", default=method, choices=("ellipsoidal", "haversine", "geodesic"),
+                        help="distance between stations")
+    common.add_argument("--average-speed", type=float, default=averageSpeed, help="train speed in km/h")
+    common.add_argument("--walk-speed", type=float, default=averageWalkSpeed, help="walking speed in km/h")
+    common.add_argument("--switch-mins", type=float, default=switchMins, help="minutes lost at every transfer")
+    common.add_argument("--walk-radius", type=float, default=walkRadiusKm,
+                        help="also walk between different stations closer than this many km")
+    common.add_argument("--no-cache", dest="cache", action="store_false", help="do not use the matrix cache")
+
+    search = argparse.ArgumentParser(add_help=False)
+    search.add_argument("--starts", type=int, help="number of independent searches, one per CPU by default")
+    search.add_argument("--workers", type=int, help="number of processes, one per CPU by default")
+    search.add_argument("--seed", type=int, default=0, help="seed of the random starts")
+    search.add_argument("--kinds", nargs="+", default=("greedy", "nearest"),
+                        choices=("random", "greedy", "nearest", "greedy-edge", "hilbert"),
+                        help="starting tour of the first search, then of the others")
+    search.add_argument("--kicks", type=int, help="go on from every local optimum with this many double-bridge kicks")
+    search.add_argument("--contract", action="store_true",
+                        help="take the stops inside line corridors out of the instance, they are put back in the route")
+    search.add_argument("--clusters", action="store_true",
+                        help="visit every station once on any of its lines instead of every stop")
+    search.add_argument("--store", default="flat", choices=("flat", "quantised", "dense"),
+                        help="cost matrix of the searches: float64 buffer, int32 costs or 2-D array")
+    search.add_argument("--polish", action="store_true", help="finish every search with a vectorised 2-opt pass")
+
+    main = argparse.ArgumentParser(description="Shortest route visiting every CDMX metro station.")
+    commands = main.add_subparsers(dest="command")
+
+    command = commands.add_parser("build-matrix", parents=[common], help="build and cache the travel time matrices")
+    command.set_defaults(run=buildMatrixCommand)
+
+    command = commands.add_parser("solve", parents=[common, search], help="find a route and print it")
+    command.add_argument("--output", help="save the route as JSON")
+    command.add_argument("--events", help="save the counters and events of the searches as JSON lines")
+    command.add_argument("--profile", choices=("cpu", "memory"),
+                         help="profile the searches, the summary goes to the events (events.jsonl by default)")
+    command.add_argument("--time-limit", type=float, help="stop after this many seconds with the best route so far")
+    command.add_argument("--checkpoints", help="directory to save the searches to, they resume from it when run again")
+    command.add_argument("--bound", action="store_true", help="print the lower bound and the gap of the route")
+    command.add_argument("--gap", type=float,
+                         help="stop the searches once within this fraction of the lower bound, e.g. 0.05")
+    command.set_defaults(run=solveCommand)
+
+    command = commands.add_parser("report", parents=[common], help="print a route saved by solve")
+    command.add_argument("route", help="JSON file written by solve --output")
+    command.set_defaults(run=reportCommand)
+
+    command = commands.add_parser("bench", parents=[common, search], help="time every stage of the pipeline")
+    command.add_argument("--repeat", type=int, default=3, help="number of runs")
+    command.set_defaults(run=benchCommand)
+
+    return main
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    # no command: solve with the default options, as the original script did
+    if not argv or argv[0].startswith("-") and argv[0] not in ("-h", "--help"):
+        argv = ["solve"] + list(argv)
 
-total = 0
+    arguments = parser()
+    args = arguments.parse_args(argv)
 
-# print solution
-for i, index in enumerate(result):
-    currentName = data.iloc[index]["Name"] + ' ' + data.iloc[index]["LineID"]
-    nextIndex = result[(i + 1) % len(result)]
-    total += dist[index][nextIndex]
+    # rejected before any work, the bound would be computed first in solveCommand
+    if getattr(args, "clusters", False):
+        conflicts = [option for option, dest in clusterConflicts
+                     if getattr(args, dest, None) not in (None, False)]
+        if conflicts:
+            arguments.error("--clusters does not work with {}".format(", ".join(conflicts)))
 
-    print(currentName)
+    args.run(args)
 
-    for p in distPath[index][nextIndex]:
-        if p != index and p != nextIndex:
-            name = data.iloc[p]["Name"] + ' ' + data.iloc[p]["LineID"]
-            print(">", name)
 
-print(total)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
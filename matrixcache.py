@@ -0,0 +1,120 @@
+# On-disk cache of the all-pairs travel times and predecessor table.
+# Entries are keyed by the SHA-256 of the station file and of the cost model
+# parameters, so editing either one builds a new entry.  Matrices are stored
+# as .npy files and memory-mapped on load.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+DIRECTORY = ".cache"
+VERSION = 1  # Bump when the layout of the matrices changes
+
+
+def cacheKey(csvPath, **parameters):
+    """
+    Hash of the station file contents and of the cost model parameters.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+    ...     _ = f.write("ID,Name,Lat,Lng,LineID\\n")
+    >>> a = cacheKey(f.name, averageSpeed=35.0, switchMins=3.0)
+    >>> a == cacheKey(f.name, switchMins=3.0, averageSpeed=35.0)
+    True
+    >>> a == cacheKey(f.name, averageSpeed=30.0, switchMins=3.0)
+    False
+    >>> os.remove(f.name)
+    """
+    digest = hashlib.sha256()
+
+    with open(csvPath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+
+    parameters = dict(parameters, version=VERSION)
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+
+def _paths(key, directory):
+    return (os.path.join(directory, key + ".dist.npy"),
+            os.path.join(directory, key + ".pred.npy"))
+
+
+def load(key, directory=DIRECTORY):
+    """
+    Memory-map the matrices of a cache entry.
+
+    Return: (dist, pred) read-only arrays, or None if there is no entry
+    """
+    distPath, predPath = _paths(key, directory)
+
+    try:
+        return (np.load(distPath, mmap_mode="r"),
+                np.load(predPath, mmap_mode="r"))
+    except (FileNotFoundError, ValueError):
+        # Missing or truncated entry
+        return None
+
+
+def save(key, dist, pred, directory=DIRECTORY):
+    """
+    Store the matrices of a cache entry.  Files are written under a temporary
+    name and renamed, so concurrent runs never read a partial entry.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    for path, matrix in zip(_paths(key, directory), (dist, pred)):
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "wb") as f:
+            np.save(f, matrix)
+        os.replace(temporary, path)
+
+
+def cached(csvPath, build, directory=DIRECTORY, **parameters):
+    """
+    Load the matrices for a station file and cost model, building and
+    storing them on a miss.
+
+    Parameters:
+
+        - csvPath: station file
+
+        - build: function returning (dist, pred), called on a miss
+
+        - directory: cache directory
+
+        - parameters: cost model parameters, part of the key
+
+    Return: (dist, pred), memory-mapped when read from the cache
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> with open(os.path.join(directory, "s.csv"), "w") as f:
+    ...     _ = f.write("ID,Name,Lat,Lng,LineID\\n")
+    >>> calls = []
+    >>> def build():
+    ...     calls.append(1)
+    ...     return np.ones((2, 2)), np.zeros((2, 2), dtype=np.int32)
+    >>> dist, _ = cached(f.name, build, directory, switchMins=3.0)
+    >>> dist, pred = cached(f.name, build, directory, switchMins=3.0)
+    >>> len(calls), type(dist).__name__, float(dist.sum()), pred.dtype.name
+    (1, 'memmap', 4.0, 'int32')
+    """
+    key = cacheKey(csvPath, **parameters)
+    matrices = load(key, directory)
+
+    if matrices is None:
+        dist, pred = build()
+        save(key, dist, pred, directory)
+        matrices = dist, pred
+
+    return matrices
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
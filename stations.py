@@ -0,0 +1,134 @@
+# Columnar station loader, the network edges are built with array operations over the whole stop table
+# so the cost grows with the number of edges instead of stations squared.
+
+import numpy as np
+
+COLUMNS = ("ID", "Name", "Lat", "Lng", "LineID")
+
+# km in one degree of latitude, or of longitude over the cosine of the latitude, rounded down for every distance method
+KM_PER_DEGREE = 110.5
+
+# neighbouring cells compared by nearbyPairs, half of them as every pair is found from its first cell
+CELL_OFFSETS = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+# reads the station file once into one array per column: ID,Name,Lat,Lng,LineID
+def readStations(path):
+    import pandas as pd
+
+    data = pd.read_csv(path, usecols=COLUMNS)
+    return {
+        "ID": data["ID"].to_numpy(),
+        "Name": data["Name"].to_numpy(dtype=object),
+        "Lat": data["Lat"].to_numpy(dtype=float),
+        "Lng": data["Lng"].to_numpy(dtype=float),
+        "LineID": data["LineID"].to_numpy(dtype=object),
+    }
+
+
+# consecutive stops of the same line, stops of a line are listed in order
+def lineEdges(lineId):
+    lineId = np.asarray(lineId)
+    frm = np.flatnonzero(lineId[1:] == lineId[:-1])
+    return frm, frm + 1
+
+
+# every pair of stops sharing a name (transfer stations), from one group-by on the name
+# the pair (i, j) has i > j, as many passes as stops in the largest group
+def transferEdges(name):
+    _, group = np.unique(np.asarray(name), return_inverse=True)
+    group = group.ravel()
+
+    # stable sort keeps the stops of a group in file order
+    order = np.argsort(group, kind="stable")
+    sortedGroup = group[order]
+    largest = np.bincount(group).max() if len(group) > 0 else 0
+
+    frm = []
+    to = []
+    for offset in range(1, largest):
+        same = sortedGroup[offset:] == sortedGroup[:-offset]
+        frm.append(order[offset:][same])
+        to.append(order[:-offset][same])
+
+    if not frm:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    return np.concatenate(frm), np.concatenate(to)
+
+
+# stops of every station name in file order, a transfer station is one group with a stop per line
+def nameGroups(name):
+    _, group = np.unique(np.asarray(name), return_inverse=True)
+    group = group.ravel()
+
+    order = np.argsort(group, kind="stable")
+    return np.split(order, np.flatnonzero(np.diff(group[order])) + 1)
+
+
+# every pair of points closer than radiusKm, as index arrays (i, j) with i != j, each pair once.  The points are put
+# in a grid of cells at least radiusKm wide, sorted by cell, and only the points of the same and of the neighbouring
+# cells are compared: near-linear for evenly spread points instead of comparing every pair.  Longitudes do not wrap
+# around the antimeridian
+def nearbyPairs(lat, lng, radiusKm, method="ellipsoidal"):
+    import costmodel
+
+    lat = np.asarray(lat, dtype=float)
+    lng = np.asarray(lng, dtype=float)
+    count = len(lat)
+
+    if count < 2 or radiusKm <= 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    # a degree of longitude is shortest at the latitude furthest from the equator
+    cosLat = max(np.cos(np.radians(np.abs(lat).max())), 1e-6)
+    row = np.floor(lat * KM_PER_DEGREE / radiusKm).astype(np.int64)
+    column = np.floor(lng * KM_PER_DEGREE * cosLat / radiusKm).astype(np.int64)
+    row -= row.min()
+    column -= column.min()
+
+    # one empty column on the right, so the column to the left of column 0 is never the last one of another row
+    width = int(column.max()) + 2
+    cell = row * width + column
+    order = np.argsort(cell, kind="stable")
+    sortedCell = cell[order]
+
+    frm = []
+    to = []
+    for dy, dx in CELL_OFFSETS:
+        target = cell + dy * width + dx
+        start = np.searchsorted(sortedCell, target, side="left")
+        counts = np.searchsorted(sortedCell, target, side="right") - start
+
+        i = np.repeat(np.arange(count), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(start, counts) + offsets]
+
+        if (dy, dx) == (0, 0):
+            i, j = i[i < j], j[i < j]
+
+        close = costmodel.distanceKm(lat[i], lng[i], lat[j], lng[j], method) <= radiusKm
+        frm.append(i[close])
+        to.append(j[close])
+
+    return np.concatenate(frm), np.concatenate(to)
+
+
+# walks between stops of different stations and lines closer than radiusKm, transfers within a station are
+# transferEdges
+def walkingEdges(stations, radiusKm, method="ellipsoidal"):
+    frm, to = nearbyPairs(stations["Lat"], stations["Lng"], radiusKm, method)
+    name = np.asarray(stations["Name"])
+    line = np.asarray(stations["LineID"])
+
+    keep = (name[frm] != name[to]) & (line[frm] != line[to])
+    return frm[keep], to[keep]
+
+
+# all edges of the network as index arrays: same line neighbours first, then transfers, then walks shorter than
+# walkRadiusKm (none if 0)
+def stationEdges(stations, walkRadiusKm=0.0, method="ellipsoidal"):
+    lineFrm, lineTo = lineEdges(stations["LineID"])
+    transferFrm, transferTo = transferEdges(stations["Name"])
+    walkFrm, walkTo = walkingEdges(stations, walkRadiusKm, method)
+    return np.concatenate((lineFrm, transferFrm, walkFrm)), np.concatenate((lineTo, transferTo, walkTo))
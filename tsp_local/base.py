@@ -1,5 +1,8 @@
+import time
 from abc import ABCMeta, abstractmethod
 
+from tsp_local.context import SolverContext
+
 class TSP():
     """
     Class to hold a TSP, sub-class will implement different improvement
@@ -7,26 +10,43 @@ class TSP():
     """
     __metaclass__ = ABCMeta
 
-    edges = {}  # Global cost matrix
-    ratio = 10.  # Global ratio
-    routes = {}  # Global routes costs
+    context = SolverContext({})  # Default context, see setEdges
 
-    def __init__(self, nodes, fast=False):
+    def __init__(self, nodes, fast=False, context=None):
         """
         Initialise a TSP instance based on a scenario.
 
         Parameters:
 
             - nodes: nodes in the scenario
+
+            - context: SolverContext holding the cost matrix and the route
+              memo, the default context set by `setEdges` if None
+
+        >>> from tsp_local.twoopt import TwoOpt, cross
+        >>> from tsp_local.threeopt import hexagon
+        >>> TSP.setEdges(hexagon)
+        >>> TwoOpt([0, 1, 2, 3], context=SolverContext(cross)).initial_cost
+        8
+        >>> TwoOpt([0, 1, 2, 3]).initial_cost
+        6
         """
         self.nodes = nodes
         self.fast = fast
+        self.context = context if context is not None else TSP.context
+        # Costs of this instance's matrix, they shadow the static methods
+        self.dist = self.context.dist
+        self.pathCost = self.context.pathCost
+        # Instrumentation, None unless the context has a recorder
+        self.recorder = self.context.recorder
 
         self.initial_path = nodes
         self.initial_cost = self.pathCost(nodes)
         # Do not save the initial path as it is not optimised
         self.heuristic_path = self.initial_path
         self.heuristic_cost = self.initial_cost
+        # Number of moves whose gain was computed
+        self.evaluated = 0
 
     def save(self, path, cost):
         """
@@ -41,7 +61,7 @@ class TSP():
         self.heuristic_path = path
         self.heuristic_cost = cost
 
-        self.routes[str(sorted(path))] = {"path": path, "cost": cost}
+        self.context.routes.put(path, {"path": path, "cost": cost})
 
     def update(self, solution):
         """
@@ -84,25 +104,31 @@ class TSP():
 
     @staticmethod
     def dist(i, j):
-        return TSP.edges[i][j]
+        return TSP.context.dist(i, j)
 
     @staticmethod
     def pathCost(path):
-        # Close the loop
-        cost = TSP.dist(path[-1], path[0])
-
-        for i in range(1, len(path)):
-            cost += TSP.dist(path[i - 1], path[i])
-
-        return cost
+        return TSP.context.pathCost(path)
 
     @staticmethod
     def setRatio(ratio):
-        TSP.ratio = ratio
+        TSP.context.ratio = ratio
 
     @staticmethod
     def setEdges(edges):
-        TSP.edges = edges
+        """
+        Replace the default context by a new one over the given cost matrix,
+        the ratio, the coordinates and the tour structure are kept.
+        """
+        TSP.context = SolverContext(edges, TSP.context.ratio,
+                                    TSP.context.coordinates,
+                                    TSP.context.routes.size,
+                                    tourKind=TSP.context.tourKind)
+
+    @staticmethod
+    def setCoordinates(coordinates):
+        TSP.context.coordinates = coordinates
+        TSP.context.candidates = {}
 
     def optimise(self):
         """
@@ -112,19 +138,45 @@ class TSP():
         >>> l = list(range(4))
         >>> TSP.setEdges(matrix)
         >>> t = TSPTest(l)
-        >>> t.routes[str(sorted(l))] = {"path": l, "cost": 16}
+        >>> t.context.routes.put(l, {"path": l, "cost": 16})
         >>> t.heuristic_path = l
         >>> t.optimise()
         ([0, 1, 2, 3], 16)
+
+        With a recorder, every solve ends with a "solve" event.
+        >>> from tsp_local.context import SolverContext
+        >>> from tsp_local.instrument import Recorder
+        >>> t = TSPTest(l, context=SolverContext(matrix, recorder=Recorder()))
+        >>> _ = t.optimise()
+        >>> event = t.recorder.events[-1]
+        >>> event["event"], event["solver"], event["cost"], event["memo"]
+        ('solve', 'TSPTest', 5569.0, False)
         """
-        route = str(sorted(self.heuristic_path))
+        saved = self.context.routes.get(self.heuristic_path)
 
-        if route in self.routes:
-            saved = TSP.routes[route]
+        if saved is not None:
             self.heuristic_path = saved["path"]
             self.heuristic_cost = saved["cost"]
-        else:
+
+            if self.recorder is not None:
+                self.recorder.emit(
+                    "solve", solver=type(self).__name__,
+                    nodes=len(self.heuristic_path),
+                    cost=float(self.heuristic_cost), memo=True)
+        elif self.recorder is None:
             self._optimise()
+        else:
+            started = time.perf_counter()
+            name = type(self).__name__
+
+            with self.recorder.profiling(solver=name):
+                self._optimise()
+
+            self.recorder.emit(
+                "solve", solver=name, nodes=len(self.heuristic_path),
+                initial_cost=float(self.initial_cost),
+                cost=float(self.heuristic_cost), evaluated=self.evaluated,
+                seconds=time.perf_counter() - started, memo=False)
 
         return self.heuristic_path, self.heuristic_cost
 
@@ -0,0 +1,349 @@
+"""
+Benchmarks of the heuristics on reproducible instances.
+
+    python -m tsp_local.bench run --output baseline.json
+    python -m tsp_local.bench compare baseline.json
+
+Every run records the wall time, the peak memory traced by tracemalloc, the
+cost of the tour and the number of moves evaluated.  The peak memory comes
+from a second, traced, run so tracing does not distort the timings.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from tsp_local.context import SolverContext
+from tsp_local.greedy import Greedy
+from tsp_local.kopt import KOpt
+from tsp_local.threeopt import ThreeOpt
+from tsp_local.twoopt import NumpyTwoOpt, TwoOpt
+
+INSTANCES = ("metro", "uniform", "clustered", "grid")
+SIZES = (100, 316, 1000)
+SCALE = 30.  # Side of the square holding the synthetic instances, in km
+SPEED = 0.5  # Minutes per km, synthetic costs are minutes like the metro
+
+# Solver name: (factory, largest instance it is run on, None for all), the
+# quadratic and cubic searches from a random tour take minutes beyond them
+SOLVERS = {
+    "Greedy": (Greedy, None),
+    "TwoOpt": (TwoOpt, 200),
+    "NumpyTwoOpt": (NumpyTwoOpt, 316),
+    "ThreeOpt": (lambda nodes, context: ThreeOpt(
+        nodes, candidates=5, context=context), 100),
+    "KOpt": (KOpt, None),
+}
+
+
+def _rows(points, metric, block=512):
+    """
+    Fill the matrix of `metric(points[rows], points)` a block of rows at a
+    time, so large instances need no temporaries of their full size.
+    """
+    matrix = np.empty((len(points), len(points)))
+
+    for first in range(0, len(points), block):
+        rows = slice(first, first + block)
+        matrix[rows] = metric(points[rows, None, :], points[None, :, :])
+
+    return matrix
+
+
+def _euclidean(points):
+    return _rows(points, lambda a, b: np.sqrt(((a - b)**2).sum(axis=2))) * \
+        SPEED
+
+
+def uniform(size, seed=0):
+    """
+    Stations spread uniformly over the square.
+
+    >>> m = uniform(5, seed=1)
+    >>> m.shape, bool((m == m.T).all()), float(m.trace())
+    ((5, 5), True, 0.0)
+    >>> bool((uniform(5, seed=1) == m).all())
+    True
+    """
+    rng = np.random.default_rng(seed)
+    return _euclidean(rng.uniform(0, SCALE, (size, 2)))
+
+
+def clustered(size, seed=0, clusters=None):
+    """
+    Stations in Gaussian clusters around a few centres, one centre for every
+    25 stations by default.
+
+    >>> clustered(50, seed=1).shape
+    (50, 50)
+    """
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(size // 25, 1)
+    centres = rng.uniform(0, SCALE, (clusters, 2))
+    members = rng.integers(0, clusters, size)
+    spread = SCALE / (4 * np.sqrt(clusters))
+    points = centres[members] + rng.normal(0, spread, (size, 2))
+    return _euclidean(points)
+
+
+def grid(size, seed=0, switchMins=3.):
+    """
+    Grid-like transit network: stations on a jittered grid of horizontal and
+    vertical lines, travel goes along the lines (Manhattan distance) and
+    changing direction costs a transfer.
+
+    >>> m = grid(16, seed=1)
+    >>> m.shape, bool((m == m.T).all())
+    ((16, 16), True)
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(size)))
+    step = SCALE / side
+    cells = np.arange(size)
+    points = np.stack((cells % side, cells // side), axis=1) * step
+    points = points + rng.uniform(-step / 4, step / 4, (size, 2))
+
+    # Pairs on neither the same row nor the same column change line, the
+    # grid row and column are kept as third and fourth coordinates
+    points = np.column_stack((points, cells // side, cells % side))
+
+    def metric(a, b):
+        straight = (a[..., 2] == b[..., 2]) | (a[..., 3] == b[..., 3])
+        return np.abs(a[..., :2] - b[..., :2]).sum(axis=2) * SPEED + \
+            np.where(straight, 0., switchMins)
+
+    return _rows(points, metric)
+
+
+def metro(size=None, seed=0):
+    """
+    Travel times between the metro stations, built by index.py and read from
+    its cache.  Needs to run from the repository root.
+    """
+    import index
+
+    data = index.loadStations()
+    dist, _ = index.loadMatrices(data)
+    return np.array(dist, dtype=float)
+
+
+GENERATORS = {
+    "metro": metro,
+    "uniform": uniform,
+    "clustered": clustered,
+    "grid": grid,
+}
+
+
+def _start(size, seed):
+    """
+    Random starting tour, the same for every solver.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.permutation(size).tolist()
+
+
+def measure(solver, matrix, path, memory=True):
+    """
+    Run one solver from a starting tour.
+
+    Parameters:
+
+        - solver: factory taking the nodes and a context
+
+        - matrix: cost matrix
+
+        - path: starting tour
+
+        - memory: also run it traced by tracemalloc to get the peak memory
+
+    Return: dictionary with the seconds, peak memory in KiB, cost and number
+    of moves evaluated
+
+    >>> from tsp_local.threeopt import hexagon, start
+    >>> m = measure(KOpt, np.array(hexagon, dtype=float), start)
+    >>> m["cost"], m["evaluated"] > 0, m["peak_kib"] > 0
+    (6.0, True, True)
+    """
+    started = time.perf_counter()
+    search = solver(list(path), context=SolverContext(matrix))
+    search._optimise()
+    seconds = time.perf_counter() - started
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        solver(list(path), context=SolverContext(matrix))._optimise()
+        peak = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+    return {
+        "seconds": seconds,
+        "peak_kib": peak,
+        "cost": float(search.heuristic_cost),
+        "evaluated": int(search.evaluated),
+    }
+
+
+def run(instances=INSTANCES, sizes=SIZES, solvers=tuple(SOLVERS), seed=0,
+        memory=True, log=None):
+    """
+    Run every solver on every instance.
+
+    Parameters:
+
+        - instances: names in GENERATORS, the metro instance has one size
+
+        - sizes: number of stations of the synthetic instances, the
+          matrices are dense so 10,000 stations take 800 MB
+
+        - solvers: names in SOLVERS, a solver is skipped on instances larger
+          than its limit
+
+        - seed: seed of the instances and of the starting tours
+
+        - memory: record the peak memory
+
+        - log: stream to report progress to
+
+    Return: JSON-ready dictionary with the environment and one entry per run
+    """
+    results = []
+
+    for name in instances:
+        for size in (None, ) if name == "metro" else sizes:
+            matrix = GENERATORS[name](size, seed=seed)
+            size = len(matrix)
+            path = _start(size, seed)
+
+            for solverName in solvers:
+                solver, limit = SOLVERS[solverName]
+                if limit is not None and size > limit:
+                    continue
+
+                entry = {"instance": name, "size": size, "seed": seed,
+                         "solver": solverName}
+                entry.update(measure(solver, matrix, path, memory))
+                results.append(entry)
+
+                if log is not None:
+                    print("{instance:<10}{size:>6} {solver:<12}"
+                          "{seconds:10.3f}s {cost:14.3f}".format(**entry),
+                          file=log)
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare(baseline, current, timeTolerance=0.25, costTolerance=1e-9):
+    """
+    Compare two runs entry by entry.
+
+    Parameters:
+
+        - baseline, current: dictionaries returned by `run`
+
+        - timeTolerance: relative slowdown accepted before a run counts as a
+          regression
+
+        - costTolerance: relative cost increase accepted
+
+    Return: list of (key, metric, baseline value, current value, regression)
+
+    >>> a = {"results": [{"instance": "grid", "size": 9, "seed": 0,
+    ...                   "solver": "KOpt", "seconds": 1., "peak_kib": 10.,
+    ...                   "cost": 5., "evaluated": 7}]}
+    >>> b = {"results": [dict(a["results"][0], seconds=2.)]}
+    >>> [(m, r) for _, m, _, _, r in compare(a, b)]
+    [('seconds', True), ('peak_kib', False), ('cost', False), ('evaluated', False)]
+    """
+    def key(entry):
+        return entry["instance"], entry["size"], entry["seed"], entry["solver"]
+
+    old = {key(entry): entry for entry in baseline["results"]}
+    rows = []
+
+    for entry in current["results"]:
+        before = old.get(key(entry))
+        if before is None:
+            continue
+
+        for metric in ("seconds", "peak_kib", "cost", "evaluated"):
+            a, b = before.get(metric), entry.get(metric)
+            if a is None or b is None:
+                continue
+
+            if metric == "seconds":
+                regression = b > a * (1 + timeTolerance)
+            elif metric == "cost":
+                regression = b > a + abs(a) * costTolerance
+            else:
+                # Memory and moves are reported, not judged
+                regression = False
+
+            rows.append((key(entry), metric, a, b, regression))
+
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for command in ("run", "compare"):
+        sub = commands.add_parser(command)
+        if command == "compare":
+            sub.add_argument("baseline", help="JSON written by run")
+            sub.add_argument("current", nargs="?",
+                             help="JSON written by run, a new run if omitted")
+            sub.add_argument("--time-tolerance", type=float, default=0.25)
+        sub.add_argument("--instances", nargs="+", default=INSTANCES,
+                         choices=INSTANCES)
+        sub.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+        sub.add_argument("--solvers", nargs="+", default=tuple(SOLVERS),
+                         choices=tuple(SOLVERS))
+        sub.add_argument("--seed", type=int, default=0)
+        sub.add_argument("--no-memory", dest="memory", action="store_false")
+        sub.add_argument("--output", help="save the run as JSON")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare" and args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        current = run(args.instances, args.sizes, args.solvers, args.seed,
+                      args.memory, log=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.command == "run":
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = 0
+    for key, metric, a, b, regression in compare(baseline, current,
+                                                 args.time_tolerance):
+        regressions += regression
+        ratio = b / a if a else float("inf") if b else 1.
+        print("{:<10}{:>6} {:<12}{:<10}{:14.4f}{:14.4f}{:8.2f}x{}".format(
+            key[0], key[1], key[3], metric, a, b, ratio,
+            "  REGRESSION" if regression else ""))
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
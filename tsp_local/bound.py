@@ -0,0 +1,141 @@
+import numpy as np
+
+from tsp_local.base import TSP
+from tsp_local.candidates import OneTree
+from tsp_local.construct import nearestNeighbour
+
+
+def gap(cost, bound):
+    """
+    Relative distance of a tour cost to a lower bound.
+
+    >>> gap(110., 100.)
+    0.1
+    """
+    return (cost - bound) / abs(bound) if bound else float("inf")
+
+
+class HeldKarp():
+    """
+    Held-Karp lower bound: the length of a minimum 1-tree, raised by
+    subgradient optimisation of node penalties (pi).  Every tour is a 1-tree
+    and the penalties add the same 2 * sum(pi) to every tour, so
+
+        w(pi) = length of the minimum 1-tree over c(i, j) + pi(i) + pi(j)
+                - 2 * sum(pi)
+
+    is a lower bound for any pi.  Each step moves pi along the degree excess
+    of the tree, d(i) - 2, and the steps are sized on the distance to an
+    upper bound (Polyak).  The penalties also give better alpha candidates,
+    see tsp_local.candidates.
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> b = HeldKarp(hexagon)
+    >>> b.bound, b.tour
+    (6.0, True)
+
+    The 1-tree of a star has three edges at its centre, penalising the
+    centre raises the bound to the best tour.
+    >>> star = [[0, 2, 2, 2, 1], [2, 0, 2, 2, 1], [2, 2, 0, 2, 1],
+    ...         [2, 2, 2, 0, 1], [1, 1, 1, 1, 0]]
+    >>> b = HeldKarp(star)
+    >>> OneTree(star).length, round(b.bound, 3), b.upper
+    (6.0, 8.0, 8.0)
+    """
+
+    def __init__(self, matrix, upper=None, iterations=1000, period=10,
+                 epsilon=1e-6):
+        """
+        Parameters:
+
+            - matrix: square cost matrix, symmetric
+
+            - upper: cost of a known tour, the cost of a nearest neighbour
+              tour if None
+
+            - iterations: largest number of subgradient steps
+
+            - period: steps without improvement before the step size halves
+
+            - epsilon: the search stops once the step factor falls below it
+        """
+        costs = np.array(matrix, dtype=float)
+        size = len(costs)
+
+        if upper is None:
+            tour = nearestNeighbour(costs)
+            upper = float(costs[tour, np.roll(tour, -1)].sum()) if size else 0.
+
+        self.upper = upper
+        self.penalties = np.zeros(size)
+        self.bound = -np.inf
+        self.tree = None
+        # Whether the best 1-tree is a tour, the bound is then optimal
+        self.tour = False
+        self.iterations = 0
+
+        if size < 3:
+            self.bound = upper
+            self.tour = True
+            return
+
+        penalties = self.penalties.copy()
+        factor = 2.
+        stall = 0
+
+        for self.iterations in range(1, iterations + 1):
+            tree = OneTree(costs, penalties)
+            value = tree.length - 2 * penalties.sum()
+
+            if value > self.bound + epsilon:
+                self.bound = value
+                self.penalties = penalties.copy()
+                self.tree = tree
+                stall = 0
+            else:
+                stall += 1
+                if stall == period:
+                    factor /= 2
+                    stall = 0
+                    if factor < epsilon:
+                        break
+
+            excess = tree.degree - 2
+            norm = float((excess * excess).sum())
+
+            if norm == 0:
+                self.tour = True
+                break
+            if value >= upper - epsilon:
+                break
+
+            penalties = penalties + factor * (upper - value) / norm * excess
+
+        self.bound = float(min(self.bound, upper))
+
+
+def lowerBound(nodes, context=None, **options):
+    """
+    Held-Karp bound over some nodes of the cost matrix of a solver context,
+    cached in the context.  The options are the ones of `HeldKarp`.
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> TSP.setEdges(hexagon)
+    >>> lowerBound(range(6)).bound
+    6.0
+    >>> lowerBound([5, 4, 3, 2, 1, 0]) is lowerBound(range(6))
+    True
+    """
+    context = context if context is not None else TSP.context
+    nodes = sorted(nodes)
+    key = tuple(nodes)
+
+    if key not in context.bounds:
+        context.bounds[key] = HeldKarp(context.submatrix(nodes), **options)
+
+    return context.bounds[key]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
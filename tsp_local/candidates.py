@@ -0,0 +1,284 @@
+import numpy as np
+
+from tsp_local.base import TSP
+
+KINDS = ("nearest", "quadrant", "alpha", "held-karp")
+
+
+class OneTree():
+    """
+    Minimum 1-tree of a cost matrix: a minimum spanning tree over every node
+    but a special one, which is linked to its two closest nodes.
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> t = OneTree(hexagon)
+    >>> t.length, t.special, sorted(t.links)
+    (6.0, 0, [1, 5])
+    >>> t.degree.tolist()
+    [2, 2, 2, 2, 2, 2]
+    """
+
+    def __init__(self, matrix, penalties=None):
+        """
+        Parameters:
+
+            - matrix: square cost matrix
+
+            - penalties: optional node penalties (pi), the tree is built over
+              the costs c(i, j) + pi(i) + pi(j)
+        """
+        costs = np.array(matrix, dtype=float)
+
+        if penalties is not None:
+            penalties = np.asarray(penalties, dtype=float)
+            costs += penalties[:, None] + penalties[None, :]
+
+        size = len(costs)
+        self.costs = costs
+        self.special = 0
+        # Prim's insertion order, parents are always inserted before children
+        self.order = []
+        self.dad = np.full(size, -1)
+        self.degree = np.zeros(size, dtype=int)
+        self.length = 0.
+
+        if size < 3:
+            self.links = []
+            return
+
+        # Minimum spanning tree over all nodes but the special one
+        root = 1
+        inTree = np.zeros(size, dtype=bool)
+        inTree[self.special] = True
+        inTree[root] = True
+        key = costs[root].copy()
+        dad = np.full(size, root)
+        self.order.append(root)
+
+        for _ in range(size - 2):
+            key[inTree] = np.inf
+            node = int(np.argmin(key))
+
+            inTree[node] = True
+            self.order.append(node)
+            self.dad[node] = dad[node]
+            self.length += float(key[node])
+            self.degree[node] += 1
+            self.degree[dad[node]] += 1
+
+            closer = costs[node] < key
+            key[closer] = costs[node][closer]
+            dad[closer] = node
+
+        # Link the special node to its two closest nodes
+        row = costs[self.special].copy()
+        row[self.special] = np.inf
+        self.links = [int(i) for i in np.argsort(row, kind="stable")[:2]]
+        self.length += float(row[self.links[0]] + row[self.links[1]])
+        self.degree[self.special] = 2
+        self.degree[self.links] += 1
+
+    def alpha(self):
+        """
+        Alpha-nearness of every pair of nodes: the increase of the 1-tree
+        length when an edge is forced in it.
+
+        >>> from tsp_local.threeopt import hexagon
+        >>> OneTree(hexagon).alpha()[0].tolist()
+        [inf, 0.0, 2.0, 2.0, 2.0, 0.0]
+        """
+        costs = self.costs
+        size = len(costs)
+        # Largest edge on the tree path between two nodes
+        beta = np.zeros((size, size))
+
+        # Inserting a leaf below its parent extends every path to the parent
+        for count, node in enumerate(self.order[1:], 1):
+            inserted = self.order[:count]
+            dad = self.dad[node]
+            beta[inserted, node] = np.maximum(beta[inserted, dad],
+                                              costs[node, dad])
+            beta[node, inserted] = beta[inserted, node]
+
+        alpha = costs - beta
+
+        # Edges of the special node replace its longest link
+        special = self.special
+        longest = max(costs[special, i] for i in self.links) if self.links \
+            else 0
+        alpha[special] = np.maximum(costs[special] - longest, 0)
+        alpha[:, special] = alpha[special]
+        np.fill_diagonal(alpha, np.inf)
+
+        return alpha
+
+
+def _closest(scores, costs, count):
+    """
+    Indices of the `count` lowest scores of every row, ties broken by cost.
+    """
+    size = len(scores)
+    count = min(count, size - 1)
+    lists = []
+
+    for i in range(size):
+        row = scores[i]
+        if count < size - 1:
+            # Keep every node tied with the last candidate before sorting
+            bound = np.partition(row, count - 1)[count - 1]
+            picked = np.flatnonzero(row <= bound)
+        else:
+            picked = np.flatnonzero(np.isfinite(row))
+
+        picked = picked[np.lexsort((costs[i, picked], row[picked]))]
+        lists.append(picked[:count])
+
+    return lists
+
+
+def nearest(matrix, count):
+    """
+    The `count` cheapest neighbours of every node.
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> [l.tolist() for l in nearest(hexagon, 2)]
+    [[1, 5], [0, 2], [1, 3], [2, 4], [3, 5], [0, 4]]
+    """
+    costs = np.array(matrix, dtype=float)
+    scores = costs.copy()
+    np.fill_diagonal(scores, np.inf)
+
+    return _closest(scores, costs, count)
+
+
+def quadrant(matrix, coordinates, count):
+    """
+    Up to `count` // 4 cheapest neighbours in each quadrant around a node,
+    completed with the cheapest remaining ones.  Keeps candidates spread
+    around stations which are on the edge of a dense cluster.
+
+    Parameters:
+
+        - matrix: square cost matrix
+
+        - coordinates: (lat, lng) of every node
+
+        - count: number of neighbours
+
+    >>> square = [[0, 1, 2, 1], [1, 0, 1, 2], [2, 1, 0, 1], [1, 2, 1, 0]]
+    >>> corners = [(0, 0), (0, 1), (1, 1), (1, 0)]
+    >>> [sorted(l.tolist()) for l in quadrant(square, corners, 2)]
+    [[1, 3], [0, 2], [1, 3], [0, 2]]
+    """
+    costs = np.array(matrix, dtype=float)
+    coordinates = np.asarray(coordinates, dtype=float)
+    size = len(costs)
+    count = min(count, size - 1)
+    lists = []
+
+    for i in range(size):
+        delta = coordinates - coordinates[i]
+        # Quadrant 0..3 from the signs of the latitude and longitude offsets
+        zone = (delta[:, 0] < 0) * 2 + (delta[:, 1] < 0)
+        row = costs[i].copy()
+        row[i] = np.inf
+        order = np.argsort(row, kind="stable")[:size - 1]
+
+        picked = []
+        for z in range(4):
+            inZone = order[zone[order] == z]
+            picked.extend(inZone[:count // 4].tolist())
+
+        chosen = set(picked)
+        for j in order:
+            if len(picked) >= count:
+                break
+            if j not in chosen:
+                picked.append(j)
+
+        picked.sort(key=lambda j: row[j])
+        lists.append(np.array(picked[:count], dtype=int))
+
+    return lists
+
+
+def alphaNearest(matrix, count, penalties=None):
+    """
+    The `count` alpha-nearest neighbours of every node (LKH candidates),
+    ties broken by cost.
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> [l.tolist() for l in alphaNearest(hexagon, 2)]
+    [[1, 5], [0, 2], [1, 3], [2, 4], [3, 5], [0, 4]]
+    """
+    tree = OneTree(matrix, penalties)
+
+    return _closest(tree.alpha(), np.array(matrix, dtype=float), count)
+
+
+def candidateSet(nodes, kind="alpha", count=5, context=None):
+    """
+    Build the candidate lists of the nodes in the cost matrix of a solver
+    context, as `{node: [(neighbour, cost), ...]}`.  The lists are cached in
+    the context.
+
+    Parameters:
+
+        - nodes: nodes of the current tour
+
+        - kind: "nearest", "quadrant", "alpha" or "held-karp" for alpha
+          over the costs raised by the penalties of the Held-Karp bound,
+          see tsp_local.bound
+
+        - count: number of candidates for each node
+
+        - context: SolverContext, the default one if None
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> TSP.setEdges(hexagon)
+    >>> candidateSet([0, 2, 4], "nearest", 5)[0]
+    [(2, 3.0), (4, 3.0)]
+    >>> candidateSet([0, 2, 4], "nearest", 5) is candidateSet([4, 2, 0],
+    ...                                                        "nearest", 5)
+    True
+    >>> candidateSet(range(6), "held-karp", 2)[0]
+    [(1, 1.0), (5, 1.0)]
+    """
+    context = context if context is not None else TSP.context
+    nodes = sorted(nodes)
+    key = (kind, count, tuple(nodes))
+
+    if key in context.candidates:
+        return context.candidates[key]
+
+    matrix = context.submatrix(nodes)
+
+    if kind == "nearest":
+        lists = nearest(matrix, count)
+    elif kind == "quadrant":
+        if context.coordinates is None:
+            raise ValueError("quadrant candidates need node coordinates, "
+                             "see TSP.setCoordinates")
+        coordinates = np.asarray(context.coordinates, dtype=float)[nodes]
+        lists = quadrant(matrix, coordinates, count)
+    elif kind == "alpha":
+        lists = alphaNearest(matrix, count)
+    elif kind == "held-karp":
+        from tsp_local.bound import lowerBound
+        penalties = lowerBound(nodes, context).penalties
+        lists = alphaNearest(matrix, count, penalties)
+    else:
+        raise ValueError("unknown candidate kind {!r}, expected one of {}"
+                         .format(kind, KINDS))
+
+    candidates = {}
+    for i, node in enumerate(nodes):
+        candidates[node] = [(nodes[j], float(matrix[i, j])) for j in lists[i]]
+
+    context.candidates[key] = candidates
+    return candidates
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,179 @@
+import time
+
+import numpy as np
+
+from tsp_local.base import TSP
+from tsp_local.kopt import KOpt
+
+
+def clusterOptimisation(order, clusters, matrix):
+    """
+    Best node of every cluster for a cyclic order of the clusters: shortest
+    cycle through the layers of the clusters, from every node of the
+    smallest one.
+
+    Parameters:
+
+        - order: cluster indices, in tour order
+
+        - clusters: nodes of every cluster
+
+        - matrix: square cost matrix, NumPy array
+
+    Return: (one node per cluster in the same cyclic order, cost)
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> clusterOptimisation([0, 1, 2], [[0, 3], [4, 1], [2, 5]],
+    ...                     np.array(hexagon, dtype=float))
+    ([0, 1, 2], 5.0)
+    """
+    if len(order) == 0:
+        return [], 0.
+
+    first = min(range(len(order)), key=lambda i: len(clusters[order[i]]))
+    layers = [np.asarray(clusters[c]) for c in order[first:] + order[:first]]
+    best, bestPath = np.inf, None
+
+    for start in layers[0]:
+        previous = np.array([start])
+        costs = np.zeros(1)
+        back = []
+
+        for nodes in layers[1:]:
+            total = costs[:, None] + matrix[np.ix_(previous, nodes)]
+            choice = np.argmin(total, axis=0)
+            back.append(choice)
+            costs = total[choice, np.arange(len(nodes))]
+            previous = nodes
+
+        total = costs + matrix[previous, start]
+        last = int(np.argmin(total))
+
+        if total[last] < best:
+            best = float(total[last])
+            path = [int(previous[last])] if len(layers) > 1 else []
+            for nodes, choice in zip(layers[-2:0:-1], back[:0:-1]):
+                last = int(choice[last])
+                path.append(int(nodes[last]))
+            bestPath = [int(start)] + path[::-1]
+
+    # Back in the order of the clusters given
+    shift = len(order) - first
+    return bestPath[shift:] + bestPath[:shift], best
+
+
+class ClusterSearch(TSP):
+    """
+    Generalised TSP: the nodes are grouped into clusters and the tour visits
+    one node of every cluster.  The search alternates between the order of
+    the clusters, improved by a TSP solver over the chosen nodes, and the
+    chosen nodes, the best ones for that order (`clusterOptimisation`),
+    until neither improves the tour.
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> from tsp_local.context import SolverContext
+    >>> t = ClusterSearch([0, 2, 4, 1, 3, 5], [[0, 3], [4, 1], [2, 5]],
+    ...                   context=SolverContext(hexagon))
+    >>> t.initial_path, t.initial_cost
+    ([0, 2, 4], 9)
+    >>> path, cost = t.optimise()
+    >>> cost, sorted(t.cluster[node] for node in path)
+    (5, [0, 1, 2])
+
+    Any TSP solver orders the clusters.
+    >>> from tsp_local.twoopt import TwoOpt
+    >>> t = ClusterSearch([3, 1, 0, 2, 4, 5], [[0], [1], [2], [3], [4, 5]],
+    ...                   solver=TwoOpt, context=SolverContext(hexagon))
+    >>> t.optimise()
+    ([4, 0, 1, 2, 3], 7)
+    >>> from tsp_local.test import matrix
+    >>> from tsp_local.threeopt import ThreeOpt
+    >>> t = ClusterSearch(range(13), [[i] for i in range(11)] + [[11, 12]],
+    ...                   solver=ThreeOpt, context=SolverContext(matrix))
+    >>> t.initial_cost, t.optimise()[1]
+    (18372, 7242)
+    """
+
+    epsilon = 1e-9  # Smallest accepted gain, rounding errors could cycle
+
+    def __init__(self, nodes, clusters, fast=False, context=None,
+                 solver=KOpt, timeLimit=None, **options):
+        """
+        Parameters:
+
+            - nodes: tour over nodes of every cluster, only the first node of
+              every cluster is kept
+
+            - clusters: nodes of every cluster, every node of the tour in
+              exactly one of them
+
+            - context: SolverContext, the default one if None
+
+            - solver: TSP subclass improving the order of the clusters
+
+            - timeLimit: stop after this many seconds with the best tour so
+              far, the solver needs a `timeLimit` option (KOpt)
+
+            - options: other options of the solver
+        """
+        self.clusters = [[int(node) for node in nodes] for nodes in clusters]
+        self.cluster = {node: i for i, nodes in enumerate(self.clusters)
+                        for node in nodes}
+        seen = set()
+        path = []
+
+        for node in nodes:
+            if self.cluster[node] not in seen:
+                seen.add(self.cluster[node])
+                path.append(node)
+
+        if len(seen) != len(self.clusters):
+            raise ValueError("the tour misses {} of the {} clusters".format(
+                len(self.clusters) - len(seen), len(self.clusters)))
+
+        super().__init__(path, fast, context)
+        self.solver = solver
+        self.timeLimit = timeLimit
+        self.options = options
+        # Rounds of the solver, and whether the last one ran to its end
+        self.rounds = 0
+        self.complete = False
+
+    def _optimise(self):
+        matrix = self.context.matrix()
+        deadline = None if self.timeLimit is None else \
+            time.perf_counter() + self.timeLimit
+        path, cost = self.heuristic_path, self.heuristic_cost
+
+        while True:
+            order = [self.cluster[node] for node in path]
+            members, change = clusterOptimisation(order, self.clusters, matrix)
+
+            if self.recorder is not None:
+                self.recorder.count("cluster_rounds")
+                self.recorder.count("cluster_gain", cost - change)
+
+            if self.rounds > 0 and change >= cost - self.epsilon:
+                break
+            if change < cost - self.epsilon:
+                path, cost = members, change
+
+            options = dict(self.options)
+            if deadline is not None:
+                options["timeLimit"] = max(deadline - time.perf_counter(), 0.)
+
+            search = self.solver(path, self.fast, context=self.context, **options)
+            path, cost = search.optimise()
+            self.evaluated += search.evaluated
+            self.rounds += 1
+            self.complete = getattr(search, "complete", True)
+
+            if not self.complete:
+                break
+
+        self.save(path, cost)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,229 @@
+import numpy as np
+
+from tsp_local.base import TSP
+
+KINDS = ("nearest", "greedy-edge", "hilbert")
+
+
+def nearestNeighbour(matrix, start=0):
+    """
+    Nearest neighbour tour, the closest unvisited node is found with one
+    `argmin` over the row of the current node.
+
+    Parameters:
+
+        - matrix: square cost matrix
+
+        - start: index of the first node
+
+    Return: tour as a list of indices
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> nearestNeighbour(hexagon, 2)
+    [2, 1, 0, 5, 4, 3]
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    size = len(matrix)
+    if size == 0:
+        return []
+
+    # Visited nodes are masked by an infinite cost
+    mask = np.zeros(size)
+    tour = [start]
+    mask[start] = np.inf
+    node = start
+
+    for _ in range(size - 1):
+        node = int(np.argmin(matrix[node] + mask))
+        tour.append(node)
+        mask[node] = np.inf
+
+    return tour
+
+
+def greedyEdge(matrix, count=10):
+    """
+    Greedy matching tour: candidate edges are taken by increasing cost when
+    both ends have a free slot and they do not close a cycle.  Only the edges
+    to the `count` closest nodes of every node are sorted, the fragments left
+    are joined from each end to the closest free end of another fragment.
+
+    Parameters:
+
+        - matrix: square cost matrix
+
+        - count: number of candidate edges of every node
+
+    Return: tour as a list of indices
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> tour = greedyEdge(hexagon, 2)
+    >>> sorted(tour)
+    [0, 1, 2, 3, 4, 5]
+    >>> sum(hexagon[tour[i - 1]][tour[i]] for i in range(6))
+    6
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    size = len(matrix)
+    if size < 3:
+        return list(range(size))
+
+    count = min(count, size - 1)
+    costs = matrix.copy()
+    np.fill_diagonal(costs, np.inf)
+
+    # Candidate edges as unique (a, b) with a < b, sorted by cost
+    close = np.argpartition(costs, count - 1, axis=1)[:, :count]
+    a = np.repeat(np.arange(size), count)
+    b = close.ravel()
+    a, b = np.minimum(a, b), np.maximum(a, b)
+    keys = np.unique(a * size + b)
+    a, b = keys // size, keys % size
+    order = np.argsort(costs[a, b], kind="stable")
+
+    degree = [0] * size
+    links = [[] for _ in range(size)]
+    # Union-find over the fragments
+    parent = list(range(size))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for i, j in zip(a[order].tolist(), b[order].tolist()):
+        if degree[i] < 2 and degree[j] < 2:
+            root, other = find(i), find(j)
+            if root != other:
+                parent[root] = other
+                degree[i] += 1
+                degree[j] += 1
+                links[i].append(j)
+                links[j].append(i)
+
+    # Walk every fragment from an end, then jump to the closest free end
+    ends = np.array([node for node in range(size) if degree[node] < 2])
+    free = np.ones(size, dtype=bool)
+    tour = []
+    node = int(ends[0])
+
+    while True:
+        prev = -1
+        while True:
+            tour.append(node)
+            free[node] = False
+            following = [n for n in links[node] if n != prev]
+            if not following:
+                break
+            prev, node = node, following[0]
+
+        ends = ends[free[ends]]
+        if len(ends) == 0:
+            return tour
+
+        node = int(ends[np.argmin(costs[node, ends])])
+
+
+def hilbertIndex(x, y, order=16):
+    """
+    Position along a Hilbert curve of integer coordinates in [0, 2 ** order).
+
+    >>> hilbertIndex(np.array([0, 0, 1, 1]), np.array([0, 1, 1, 0]), 1)
+    array([0, 1, 2, 3])
+    """
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    index = np.zeros_like(x)
+    side = 1 << order
+    s = side >> 1
+
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        index += s * s * ((3 * rx) ^ ry)
+
+        # Rotate the quadrant so the curve is continuous
+        flip = ~ry & rx
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s >>= 1
+
+    return index
+
+
+def hilbert(coordinates, order=16):
+    """
+    Order the nodes along a Hilbert curve over their (lat, lng), longitudes
+    are scaled by the cosine of the mean latitude so the grid is square.
+
+    >>> hilbert([(0, 0), (0.1, 0.1), (0, 0.1), (0.1, 0)])
+    [0, 3, 1, 2]
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    if len(coordinates) == 0:
+        return []
+
+    lat, lng = coordinates[:, 0], coordinates[:, 1]
+    points = np.column_stack((lng * np.cos(np.radians(lat.mean())), lat))
+    points -= points.min(axis=0)
+    scale = points.max()
+    if scale > 0:
+        points *= ((1 << order) - 1) / scale
+
+    cells = points.astype(np.int64)
+    return np.argsort(hilbertIndex(cells[:, 0], cells[:, 1], order),
+                      kind="stable").tolist()
+
+
+def construct(kind, nodes, start=None, context=None):
+    """
+    Build a tour over some nodes of the cost matrix of a solver context.
+
+    Parameters:
+
+        - kind: "nearest", "greedy-edge" or "hilbert"
+
+        - nodes: nodes to visit
+
+        - start: first node of a nearest neighbour tour, the first node of
+          `nodes` if None
+
+        - context: SolverContext, the default one if None, "hilbert" needs
+          its coordinates
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> TSP.setEdges(hexagon)
+    >>> construct("nearest", [5, 1, 3], start=3)
+    [3, 5, 1]
+    """
+    context = context if context is not None else TSP.context
+    nodes = list(nodes)
+    if len(nodes) == 0:
+        return []
+
+    if kind == "hilbert":
+        if context.coordinates is None:
+            raise ValueError("hilbert tours need node coordinates, see "
+                             "TSP.setCoordinates")
+        coordinates = np.asarray(context.coordinates, dtype=float)[nodes]
+        order = hilbert(coordinates)
+    else:
+        matrix = context.submatrix(nodes)
+
+        if kind == "nearest":
+            first = 0 if start is None else nodes.index(start)
+            order = nearestNeighbour(matrix, first)
+        elif kind == "greedy-edge":
+            order = greedyEdge(matrix)
+        else:
+            raise ValueError("unknown construction {!r}, expected one of {}"
+                             .format(kind, KINDS))
+
+    return [nodes[i] for i in order]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
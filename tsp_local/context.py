@@ -0,0 +1,157 @@
+import threading
+from collections import OrderedDict
+
+from tsp_local.store import makeStore
+
+
+def routeKey(path):
+    """
+    Compact key of the set of nodes of a route: a bitmask with one bit per
+    node, independent of the order of the nodes.
+
+    >>> routeKey([3, 0, 9]) == routeKey([0, 9, 3])
+    True
+    >>> routeKey([3, 0, 9])
+    b'\\t\\x02'
+    """
+    mask = bytearray((max(path) >> 3) + 1 if len(path) > 0 else 0)
+
+    for node in path:
+        mask[node >> 3] |= 1 << (node & 7)
+
+    return bytes(mask)
+
+
+class RouteMemo():
+    """
+    Bounded memo of the best route found for a set of nodes, the least
+    recently used routes are evicted first.
+
+    >>> memo = RouteMemo(2)
+    >>> memo.put([0, 1], {"path": [0, 1], "cost": 2})
+    >>> memo.put([1, 2], {"path": [1, 2], "cost": 3})
+    >>> memo.get([1, 0])["cost"]
+    2
+    >>> memo.put([2, 3], {"path": [2, 3], "cost": 4})
+    >>> memo.get([1, 2]) is None, len(memo)
+    (True, 2)
+    """
+
+    def __init__(self, size=1024):
+        """
+        Parameters:
+
+            - size: maximum number of routes kept, unbounded if None
+        """
+        self.size = size
+        self.routes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.routes)
+
+    def get(self, path):
+        key = routeKey(path)
+
+        with self.lock:
+            route = self.routes.get(key)
+            if route is not None:
+                self.routes.move_to_end(key)
+
+        return route
+
+    def put(self, path, route):
+        key = routeKey(path)
+
+        with self.lock:
+            self.routes[key] = route
+            self.routes.move_to_end(key)
+
+            if self.size is not None:
+                while len(self.routes) > self.size:
+                    self.routes.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+
+
+class SolverContext():
+    """
+    State shared by the solves over one cost matrix: the matrix itself, the
+    ratio, the node coordinates, the tour structure of the searches, the route
+    memo, the candidate lists and the lower bounds.
+    Every TSP instance gets one, so solves over different matrices can run
+    side by side.
+
+    >>> from tsp_local.twoopt import cross
+    >>> c = SolverContext(cross)
+    >>> c.dist(0, 2), c.pathCost([0, 1, 2, 3])
+    (3, 8)
+
+    The matrix is kept in a distance store, see tsp_local.store.
+    >>> c = SolverContext(cross, store="quantised")
+    >>> c.dist(0, 2), c.pathCost([0, 1, 2, 3]), c.submatrix([0, 2]).tolist()
+    (3.0, 8.0, [[0.0, 3.0], [3.0, 0.0]])
+    """
+
+    def __init__(self, edges, ratio=10., coordinates=None, memoSize=1024,
+                 recorder=None, store=None, tourKind=None):
+        """
+        Parameters:
+
+            - edges: cost matrix or tsp_local.store.DistanceStore
+
+            - ratio: ratio used by the heuristics
+
+            - coordinates: optional (lat, lng) of the nodes
+
+            - memoSize: maximum number of routes kept in the memo
+
+            - recorder: optional tsp_local.instrument.Recorder receiving the
+              counters and events of the solves
+
+            - store: kind of distance store for the matrix, see
+              tsp_local.store.makeStore
+
+            - tourKind: tour structure of the searches, "array" or
+              "two-level", chosen from the tour size if None, see
+              tsp_local.tour.makeTour
+        """
+        self.edges = makeStore(edges, store)
+        # Scalar lookup of the store, the most called function of the searches
+        self.dist = self.edges.dist
+        self.ratio = ratio
+        self.coordinates = coordinates
+        self.routes = RouteMemo(memoSize)
+        self.candidates = {}  # Candidate lists, see tsp_local.candidates
+        self.bounds = {}  # Lower bounds, see tsp_local.bound
+        self.recorder = recorder
+        self.tourKind = tourKind
+
+    def pathCost(self, path):
+        dist = self.dist
+        # Close the loop
+        cost = dist(path[-1], path[0])
+
+        for i in range(1, len(path)):
+            cost += dist(path[i - 1], path[i])
+
+        return cost
+
+    def submatrix(self, nodes):
+        """
+        Costs between some nodes as a float array, in the order of `nodes`.
+        """
+        return self.edges.submatrix(nodes)
+
+    def matrix(self):
+        """
+        The whole cost matrix as a float array.
+        """
+        return self.edges.matrix()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
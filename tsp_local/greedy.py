@@ -1,8 +1,11 @@
 from tsp_local.base import TSP
+from tsp_local.construct import construct
 
 class Greedy(TSP):
     """
-    Implement the greedy heuristic for the TSP.
+    Implement the greedy heuristic for the TSP, nearest neighbour from the
+    first node of the path.  See tsp_local.construct for the other
+    construction heuristics.
     """
 
     def _optimise(self):
@@ -22,33 +25,20 @@ class Greedy(TSP):
         True
         >>> t.heuristic_cost == t.pathCost(t.heuristic_path)
         True
+        >>> t.heuristic_path[0]
+        0
 
         """
         if len(self.heuristic_path) == 0:
             return
 
-        nodes = set(self.heuristic_path)
-        i = nodes.pop()
-        path = [i]
-        cost = 0
-
-        while len(nodes) > 0:
-            best = float('inf')
-
-            for j in nodes:
-                dist = self.dist(i, j)
-
-                if dist < best:
-                    best = dist
-                    node = j
-
-            path.append(node)
-            cost += best
-            i = node
-            nodes.remove(node)
-
-        self.save(path, cost + self.dist(path[-1], path[0])) # Relink
+        # Nearest neighbour from the first node of the current path
+        path = construct("nearest", self.heuristic_path,
+                         self.heuristic_path[0], self.context)
+        # One row for every node added
+        self.evaluated += len(path) * (len(path) - 1) // 2
 
+        self.save(path, self.pathCost(path))
 
 if __name__ == "__main__":
     import doctest
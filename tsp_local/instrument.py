@@ -0,0 +1,133 @@
+import contextlib
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+
+PROFILES = ("cpu", "memory")
+
+
+class Recorder():
+    """
+    Opt-in instrumentation of the solves of a context: counters, timers and
+    events written as JSON lines.  Solvers only look for a recorder at coarse
+    points (a solve, a pass, an accepted move), so without one the hot loops
+    are unchanged.
+
+    >>> import io
+    >>> out = io.StringIO()
+    >>> r = Recorder(out)
+    >>> r.count("accepted")
+    >>> r.count("gain", 2.5)
+    >>> r.emit("move", k=2, gain=2.5)
+    >>> dict(r.counters)
+    {'accepted': 1, 'gain': 2.5}
+    >>> event = json.loads(out.getvalue())
+    >>> event["event"], event["k"], event["gain"]
+    ('move', 2, 2.5)
+
+    Without a stream, the events are kept in memory.
+    >>> r = Recorder()
+    >>> r.emit("pass", seconds=0.1)
+    >>> r.events[0]["event"]
+    'pass'
+    """
+
+    def __init__(self, stream=None, profile=None, top=20):
+        """
+        Parameters:
+
+            - stream: file to write the events to, one JSON object per line,
+              kept in `events` if None
+
+            - profile: wrap every solve in "cpu" (cProfile) or "memory"
+              (tracemalloc) profiling, the summary is emitted as an event
+
+            - top: number of functions or allocation sites in a profile
+        """
+        if profile is not None and profile not in PROFILES:
+            raise ValueError("unknown profile {!r}, expected one of {}".format(
+                profile, PROFILES))
+
+        self.stream = stream
+        self.profile = profile
+        self.top = top
+        self.counters = defaultdict(int)
+        self.events = []
+        self.started = time.perf_counter()
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def emit(self, event, **fields):
+        """
+        Record an event, the time since the recorder was created is added.
+        """
+        record = {"event": event,
+                  "time": round(time.perf_counter() - self.started, 6)}
+        record.update(fields)
+
+        if self.stream is None:
+            self.events.append(record)
+        else:
+            self.stream.write(json.dumps(record) + "\n")
+
+    @contextlib.contextmanager
+    def profiling(self, **fields):
+        """
+        Profile the block if the recorder was created with a profile, a
+        "profile" event summarises it.
+
+        >>> r = Recorder(profile="cpu", top=3)
+        >>> with r.profiling(solver="test"):
+        ...     _ = sorted(range(1000))
+        >>> r.events[0]["event"], r.events[0]["kind"], len(r.events[0]["top"])
+        ('profile', 'cpu', 3)
+        """
+        if self.profile is None:
+            yield
+            return
+
+        if self.profile == "cpu":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+
+            stats = pstats.Stats(profiler)
+            top = []
+            for (path, line, name), (_, calls, own, total, _) in sorted(
+                    stats.stats.items(), key=lambda item: -item[1][3]):
+                top.append({"function": "{}:{}({})".format(path, line, name),
+                            "calls": calls, "own": own, "total": total})
+                if len(top) == self.top:
+                    break
+
+            self.emit("profile", kind="cpu", top=top, **fields)
+        else:
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            try:
+                yield
+            finally:
+                peak = tracemalloc.get_traced_memory()[1]
+                after = tracemalloc.take_snapshot()
+                if not tracing:
+                    tracemalloc.stop()
+
+            top = [{"site": str(stat.traceback), "size": stat.size_diff,
+                    "count": stat.count_diff}
+                   for stat in after.compare_to(before, "lineno")[:self.top]]
+            self.emit("profile", kind="memory", peak=peak, top=top, **fields)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,307 @@
+import random
+import time
+from collections import deque
+
+from tsp_local.kopt import KOpt
+
+ACCEPTANCE = ("better", "equal", "threshold")
+MASK = (1 << 64) - 1
+
+
+def edgeHash(i, j):
+    """
+    64-bit hash of the undirected edge (i, j), splitmix64 of its key.
+
+    >>> edgeHash(3, 5) == edgeHash(5, 3) != edgeHash(3, 6)
+    True
+    >>> import numpy as np
+    >>> edgeHash(np.int64(3), np.int64(5)) == edgeHash(3, 5)
+    True
+    """
+    # NumPy integers would overflow in the shift
+    i, j = int(i), int(j)
+    if i > j:
+        i, j = j, i
+
+    x = ((i << 32 | j) + 0x9E3779B97F4A7C15) & MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+    return x ^ (x >> 31)
+
+
+def tourHash(tour):
+    """
+    Hash of a tour as the XOR of the hashes of its edges: the same for every
+    rotation and reflection, and updated in O(1) per changed edge.
+
+    >>> tourHash([0, 1, 2, 3]) == tourHash([2, 1, 0, 3]) == tourHash([3, 0, 1, 2])
+    True
+    >>> tourHash([0, 1, 2, 3]) == tourHash([0, 2, 1, 3])
+    False
+    """
+    value = 0
+
+    for i in range(len(tour)):
+        value ^= edgeHash(tour[i - 1], tour[i])
+
+    return value
+
+
+class IteratedKOpt(KOpt):
+    """
+    Iterated Lin-Kernighan: once KOpt finds no improving move, the tour is
+    perturbed by a double-bridge kick on a short stretch of the tour and the
+    search starts again from the nodes of the kick only.  A kick which does
+    not pass the acceptance criterion is undone from the tour's log, so each
+    kick costs about as much as the few moves it triggers.
+
+    Visited local optima are remembered by `tourHash`, kept up to date move
+    by move, and a kick landing on one of them is rejected.
+
+    >>> from tsp_local.test import matrix
+    >>> from tsp_local.context import SolverContext
+    >>> t = IteratedKOpt(list(range(13)), context=SolverContext(matrix),
+    ...                  kicks=20)
+    >>> t._optimise()
+    >>> t.heuristic_cost, t.pathCost(t.heuristic_path), t.kicked
+    (7293.0, 7293, 20)
+    >>> t.hash == tourHash(t.heuristic_path)
+    True
+
+    Nodes may be a NumPy array.
+    >>> import numpy as np
+    >>> t = IteratedKOpt(np.arange(13), context=SolverContext(matrix),
+    ...                  kicks=20)
+    >>> t.optimise()[1]
+    7293.0
+
+    On an even tour, where a kick can reverse exactly half of it.
+    >>> m = [[abs(i - j) + (i * j) % 3 for j in range(10)] for i in range(10)]
+    >>> for i in range(10):
+    ...     m[i][i] = 0
+    >>> t = IteratedKOpt(list(range(10)), context=SolverContext(m), kicks=50)
+    >>> path, cost = t.optimise()
+    >>> cost == t.pathCost(path), t.hash == tourHash(path)
+    (True, True)
+    """
+
+    def __init__(self, nodes, fast=False, context=None, kicks=100, window=50,
+                 acceptance="better", threshold=0.01, seed=0, **options):
+        """
+        Parameters:
+
+            - nodes: nodes in the scenario, in tour order
+
+            - context: SolverContext, the default one if None
+
+            - kicks: number of kicks after the first local optimum
+
+            - window: the four edges of a kick are taken among this many
+              consecutive nodes
+
+            - acceptance: tour kept after a kick, "better" if it is shorter
+              than the current one, "equal" if it is not longer, "threshold"
+              if it is within `threshold` of the best tour found
+
+            - threshold: fraction of the best cost, see `acceptance`
+
+            - seed: seed of the kicks
+
+            - options: options of KOpt, the time, iteration and gap limits
+              also stop the kicks
+        """
+        if acceptance not in ACCEPTANCE:
+            raise ValueError("unknown acceptance {!r}, expected one of {}"
+                             .format(acceptance, ACCEPTANCE))
+
+        super().__init__(nodes, fast, context, **options)
+        self.kicks = kicks
+        self.window = window
+        self.acceptance = acceptance
+        self.threshold = threshold
+        self.seed = seed
+        # Kicks tried and kept
+        self.kicked = 0
+        self.accepted = 0
+
+    def _optimise(self):
+        started = time.perf_counter()
+        # The iteration limit is shared by the descent and the kicks
+        lastIteration = None if self.iterationLimit is None else \
+            self.iterations + self.iterationLimit
+        self.hash = tourHash(self.heuristic_path)
+        super()._optimise()
+
+        if not self.complete or self.kicks == 0 or len(self.heuristic_path) < 8:
+            return
+
+        deadline = None if self.timeLimit is None else \
+            started + self.timeLimit
+        target = None if self.gap is None else \
+            self.bound + abs(self.bound) * self.gap
+
+        began = time.perf_counter()
+        rng = random.Random(self.seed)
+        tour = self.tour
+        nodes = tour.nodes()
+        active = [False] * tour.span
+        visited = {self.hash}
+        current = best = self.heuristic_cost
+        bestPath = nodes
+        del tour.log[:]
+
+        for _ in range(self.kicks):
+            if (deadline is not None and time.perf_counter() >= deadline) or \
+                    (lastIteration is not None and
+                     self.iterations >= lastIteration) or \
+                    (target is not None and best <= target):
+                break
+
+            self.kicked += 1
+            mark = len(tour.log)
+            previous, length = self.hash, tour.length
+
+            self._descend(self.kick(rng, nodes), active)
+
+            cost = self.heuristic_cost
+            seen = self.hash in visited
+            visited.add(self.hash)
+
+            if not seen and self.accept(cost, current, best):
+                self.accepted += 1
+                current = cost
+                del tour.log[:]
+
+                if cost < best - self.epsilon:
+                    best = cost
+                    bestPath = tour.nodes()
+                    if self.recorder is not None:
+                        self.recorder.emit("kick", index=self.kicked,
+                                           cost=float(cost))
+            else:
+                tour.undo(mark)
+                self.heuristic_cost, tour.length = current, length
+                self.hash = previous
+
+            if self.recorder is not None:
+                self.recorder.count("kicks")
+                self.recorder.count("kicks_seen", seen)
+
+        self.seconds += time.perf_counter() - began
+
+        # The current tour may be worse than the best one with a threshold
+        if self.heuristic_cost > best:
+            self.hash = tourHash(bestPath)
+        self.heuristic_path = bestPath
+        self.heuristic_cost = best
+
+        if self.checkpoint is not None:
+            self.saveCheckpoint(self.checkpoint, [], False)
+
+        self.save(self.heuristic_path, self.heuristic_cost)
+
+    def accept(self, cost, current, best):
+        """
+        Whether the tour after a kick replaces the current one.
+        """
+        if self.acceptance == "better":
+            return cost < current - self.epsilon
+        elif self.acceptance == "equal":
+            return cost <= current + self.epsilon
+
+        return cost <= best + abs(best) * self.threshold
+
+    def kick(self, rng, nodes):
+        """
+        Segment double bridge: cut the tour A B C D at four edges among
+        `window` consecutive nodes, with A the rest of the tour, and
+        reconnect it as A D C B.  No sequential move of KOpt undoes it.
+
+        Return: the nodes of the changed edges
+        """
+        tour = self.tour
+        dist = self.dist
+        length = min(self.window, tour.size - 2)
+
+        walk = [rng.choice(nodes)]
+        for _ in range(length + 1):
+            walk.append(tour.next(walk[-1]))
+
+        p, q, r = sorted(rng.sample(range(1, length + 1), 3))
+        a, b1, b2, c1, c2, d1, d2, e = walk[0], walk[1], walk[p], \
+            walk[p + 1], walk[q], walk[q + 1], walk[r], walk[r + 1]
+
+        # Reverse B C D, then each of them back: A D C B.  Every stretch
+        # is given with the node before it, outside of it
+        for before, first, last, count in ((a, b1, d2, r),
+                                           (a, d2, d1, r - q),
+                                           (d2, c2, c1, q - p),
+                                           (c2, b2, b1, p)):
+            self._reverse(before, first, last, count)
+
+        removed = ((a, b1), (b2, c1), (c2, d1), (d2, e))
+        added = ((a, d1), (d2, c1), (c2, b1), (b2, e))
+
+        for i, j in removed + added:
+            self.hash ^= edgeHash(i, j)
+
+        gain = sum(dist(i, j) for i, j in removed) - \
+            sum(dist(i, j) for i, j in added)
+        self.heuristic_cost -= gain
+        tour.length -= gain
+
+        return [a, b1, b2, c1, c2, d1, d2, e]
+
+    def _reverse(self, before, first, last, count):
+        """
+        Reverse the stretch of `count` nodes from `first` to `last`,
+        whichever way the tour currently runs through it.  `before` is the
+        neighbour of `first` outside of the stretch: the tour runs forward
+        through it if `before` precedes `first`.  A flip may reverse the
+        rest of the tour instead, so the direction is checked every time.
+        """
+        if count < 2:
+            return
+
+        if self.tour.prev(first) == before:
+            self.tour.flip(first, last)
+        else:
+            self.tour.flip(last, first)
+
+    def _descend(self, queue, active):
+        """
+        Improve from the nodes in the queue only, until none of them or of
+        the nodes of the moves they lead to gives an improving move.
+        """
+        queue = deque(queue)
+
+        for node in queue:
+            active[node] = True
+
+        while queue:
+            t1 = queue.popleft()
+            active[t1] = False
+            self.iterations += 1
+
+            if self.improve(t1):
+                for node in self.changed:
+                    if not active[node]:
+                        active[node] = True
+                        queue.appendleft(node)
+
+    def apply(self, tour, k, gain):
+        """
+        Apply the move and update the hash of the tour.
+        """
+        t = self.t
+
+        for i in range(1, k + 1):
+            self.hash ^= edgeHash(t[2 * i - 1], t[2 * i])
+            self.hash ^= edgeHash(t[2 * i], t[2 * i + 1] if i < k else t[1])
+
+        super().apply(tour, k, gain)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
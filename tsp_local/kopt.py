@@ -1,183 +1,347 @@
-from copy import deepcopy
+import json
+import os
+import time
+from collections import deque
 
 from tsp_local.base import TSP
+from tsp_local.bound import lowerBound
+from tsp_local.candidates import candidateSet
+from tsp_local.tour import Tour, makeTour  # noqa: F401
 
-def makePair(i, j):
-    if i > j:
-        return (j, i)
-    else:
-        return (i, j)
-
-
-class Tour():
+class KOpt(TSP):
     """
-    Class to represent a tour in LKH.
+    K-opt move for the TSP, will become Lin-Kernighan.
     """
 
-    def __init__(self, tour):
-        self.tour = tour
-        self.size = len(tour)
-        self.length = TSP.pathCost(tour)
-        self._makeEdges()
+    candidateKind = "alpha"  # Candidate lists: "nearest", "quadrant", "alpha"
+    candidateCount = 5  # Number of candidates for each node
+    maxDepth = 50  # Largest k of a single k-opt move
+    epsilon = 1e-9  # Smallest accepted gain, rounding errors could cycle
+    tries = 5  # Candidates tried as t3 for every t2
+    breadth = 5  # Candidates tried as t5 when k = 2, then only the best one
 
-    def _makeEdges(self):
+    def __init__(self, nodes, fast=False, context=None, timeLimit=None,
+                 iterationLimit=None, checkpoint=None, checkpointEvery=60.,
+                 gap=None, bound=None):
         """
-        Create the list of edges from the current tour.
+        Parameters:
 
-        >>> TSP.setEdges([[1] * 6] * 6)  # Dummy matrix
-        >>> t = Tour([1, 2, 3, 4, 5])
-        >>> t.edges == set([(1, 2), (2, 3), (3, 4), (4, 5), (1, 5)])
-        True
-        """
-        self.edges = set()
+            - nodes: nodes in the scenario, in tour order
 
-        for i in range(self.size):
-            self.edges.add(makePair(self.tour[i - 1], self.tour[i]))
+            - context: SolverContext, the default one if None
 
-    def at(self, i):
-        return self.tour[i]
+            - timeLimit: stop after this many seconds with the best tour so
+              far, no limit if None
 
-    def contains(self, edge):
-        """
-        Check if an edge belongs to the tour
-        """
-        return edge in self.edges
+            - iterationLimit: stop after this many calls to `improve`
 
-    def index(self, i):
-        """
-        Return the index of a node in a tour.
-        """
-        return self.tour.index(i)
-
-    def around(self, node):
-        """
-        Return the predecessor and successor of the current node, given by
-        index.
+            - checkpoint: file to save the search to, see `resume`
 
-        Parameters:
+            - checkpointEvery: seconds between two checkpoints, one is also
+              saved when the search stops
 
-            - node: node to look around
+            - gap: stop once the tour is within this fraction of a lower
+              bound, for instance 0.01 for 1%
 
-        Return: (pred, succ)
+            - bound: lower bound of the tour length, the Held-Karp bound of
+              the nodes if None, see tsp_local.bound
         """
-        index = self.tour.index(node)
-
-        pred = index - 1
-        succ = index + 1
-
-        if succ == self.size:
-            succ = 0
-
-        return (self.tour[pred], self.tour[succ])
-
-    def pred(self, index, prev):
+        super().__init__(nodes, fast, context)
+        self.timeLimit = timeLimit
+        self.iterationLimit = iterationLimit
+        self.checkpoint = checkpoint
+        self.checkpointEvery = checkpointEvery
+        self.gap = gap
+        self.bound = bound
+        # Whether the last search ran until no improvement was left
+        self.complete = False
+        # Calls to `improve` over all the runs of the search
+        self.iterations = 0
+        self.seconds = 0.
+        # Queue of active nodes to resume from, see `resume`
+        self.state = None
+
+    @staticmethod
+    def setCandidates(kind, count):
+        KOpt.candidateKind = kind
+        KOpt.candidateCount = count
+
+    @classmethod
+    def resume(cls, path, context=None, **options):
         """
-        Return the predecessor or successor depending on the `prev` parameter.
+        Continue a search saved to a checkpoint, the options are the ones of
+        the constructor.
+
+        >>> import tempfile
+        >>> from tsp_local.test import matrix
+        >>> path = os.path.join(tempfile.mkdtemp(), "search.json")
+        >>> TSP.setEdges(matrix)
+        >>> t = KOpt(list(range(13)), iterationLimit=3, checkpoint=path)
+        >>> t._optimise()
+        >>> t.complete, t.iterations
+        (False, 3)
+        >>> r = KOpt.resume(path)
+        >>> r.heuristic_cost == t.heuristic_cost, r.initial_cost
+        (True, 18703.0)
+        >>> r._optimise()
+        >>> r.complete, r.iterations > 3, r.heuristic_cost <= t.heuristic_cost
+        (True, True, True)
         """
-        return self.tour[index - 1] if prev else self.tour[index + 1]
-
-    def generate(self, broken, joined):
+        with open(path) as f:
+            state = json.load(f)
+
+        search = cls(state["tour"], context=context, **options)
+        if abs(search.heuristic_cost - state["cost"]) > 1e-6 * max(
+                abs(state["cost"]), 1):
+            raise ValueError("checkpoint {} does not match the cost matrix"
+                             .format(path))
+
+        search.initial_cost = state["initial_cost"]
+        search.iterations = state["iterations"]
+        search.evaluated = state["evaluated"]
+        search.seconds = state["seconds"]
+        search.complete = state["complete"]
+        if search.bound is None:
+            search.bound = state.get("bound")
+        search.state = state
+        return search
+
+    def saveCheckpoint(self, path, queue, better):
+        """
+        Save the current tour, which is the best found so far, and the queue
+        of active nodes.  The file is written under a temporary name and
+        renamed, a search killed while saving keeps its previous checkpoint.
         """
-        Generate a temporary tour with the current exclusions and inclusions.
+        state = {
+            "version": 1,
+            "solver": type(self).__name__,
+            "tour": [int(node) for node in self.heuristic_path],
+            "cost": float(self.heuristic_cost),
+            "initial_cost": float(self.initial_cost),
+            "queue": [int(node) for node in queue],
+            "better": better,
+            "iterations": self.iterations,
+            "evaluated": self.evaluated,
+            "seconds": self.seconds,
+            "complete": not queue,
+            "bound": self.bound,
+        }
+
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "w") as f:
+            json.dump(state, f)
+        os.replace(temporary, path)
 
-        Test optimal 2-opt
-        >>> from tsp_local.twoopt import cross, start
-        >>> TSP.setEdges(cross)
-        >>> t = Tour(start)
-        >>> _, tour = t.generate(set([(0, 2), (1, 3)]), set([(0, 1), (2, 3)]))
-        >>> TSP.pathCost(tour)
-        8
+    def _optimise(self):
+        """
+        Global loop over the active nodes, a node becomes active again when
+        one of its tour edges is changed by an improving move.
 
-        Test disjoint tour
         >>> from tsp_local.threeopt import hexagon, start
         >>> TSP.setEdges(hexagon)
-        >>> t = Tour(start)
-        >>> t.generate(
-        ...     set([(0, 3), (4, 5)]), set([(0, 5), (3, 4)])) #doctest:+ELLIPSIS
-        (False, ...)
-
-        Test optimal 3-opt
-        >>> _, tour = t.generate(
-        ...    set([(0, 3), (2, 4), (1, 5)]), set([(0, 5), (3, 4), (1, 2)]))
-        >>> TSP.pathCost(tour)
-        6
+        >>> t = KOpt(start)
+        >>> t._optimise()
+        >>> t.heuristic_cost
+        6.0
+
+        With a recorder, every pass and accepted move is reported.
+        >>> from tsp_local.context import SolverContext
+        >>> from tsp_local.instrument import Recorder
+        >>> t = KOpt(start, context=SolverContext(hexagon, recorder=Recorder()))
+        >>> t._optimise()
+        >>> [e["event"] for e in t.recorder.events]
+        ['start', 'move', 'move', 'pass', 'pass']
+        >>> t.recorder.counters["accepted"], t.recorder.counters["gain"]
+        (2, 6.0)
+
+        With a budget, the best tour so far is kept when it runs out.
+        >>> t = KOpt(start, context=SolverContext(hexagon), iterationLimit=1)
+        >>> t._optimise()
+        >>> t.complete, t.heuristic_cost
+        (False, 10.0)
+
+        With a gap, the search stops as soon as the tour is close enough to
+        the lower bound.
+        >>> from tsp_local.test import matrix
+        >>> t = KOpt(list(range(13)), context=SolverContext(matrix), gap=0.1)
+        >>> t._optimise()
+        >>> t.heuristic_cost <= t.bound * 1.1, t.complete
+        (True, False)
         """
-        # New edges: old edges minus broken, plus joined
-        edges = (self.edges - broken) | joined
-
-        # If we do not have enough edges, we cannot form a tour -- should not
-        # happen within LKH
-        if len(edges) < self.size:
-            return False, []
-
-        successors = {}
-        node = 0
-
-        # Build the list of successors
-        while len(edges) > 0:
-            for i, j in edges:
-                if i == node:
-                    successors[node] = j
-                    node = j
-                    break
-                elif j == node:
-                    successors[node] = i
-                    node = i
+        # Budget of this run, the setup (candidate lists, tour, bound) counts
+        started = time.perf_counter()
+
+        # Stack of the t_i nodes of the current move, t_0 is unused
+        self.t = [0] * (2 * self.maxDepth + 2)
+
+        # Short candidate lists sorted by the candidate measure, cached for
+        # the cost matrix
+        self.neighbours = candidateSet(
+            self.heuristic_path, self.candidateKind, self.candidateCount,
+            self.context)
+        # Moves are applied in place on the tour
+        self.tour = makeTour(self.heuristic_path, self.context)
+
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.emit("start", solver=type(self).__name__,
+                          nodes=len(self.heuristic_path),
+                          cost=float(self.heuristic_cost))
+            self.passes = 0
+            self._mark()
+
+        # Don't-look bits: only the nodes in the queue are tried as t1
+        if self.state is None:
+            queue = deque(self.heuristic_path)
+            better = False
+        else:
+            queue = deque(self.state["queue"])
+            better = self.state["better"]
+            self.state = None
+        active = [False] * self.tour.span
+
+        for node in queue:
+            active[node] = True
+
+        deadline = None if self.timeLimit is None else \
+            started + self.timeLimit
+        lastIteration = None if self.iterationLimit is None else \
+            self.iterations + self.iterationLimit
+        nextCheckpoint = None if self.checkpoint is None else \
+            started + self.checkpointEvery
+        target = None
+        if self.gap is not None:
+            if self.bound is None:
+                self.bound = lowerBound(self.heuristic_path, self.context,
+                                        upper=self.heuristic_cost).bound
+            target = self.bound + abs(self.bound) * self.gap
+
+        while queue:
+            if self.iterations == lastIteration:
+                break
+            if target is not None and self.heuristic_cost <= target:
+                break
+
+            if deadline is not None or nextCheckpoint is not None:
+                now = time.perf_counter()
+
+                if deadline is not None and now >= deadline:
                     break
 
-            edges.remove((i, j))
+                if nextCheckpoint is not None and now >= nextCheckpoint:
+                    self.seconds += now - started
+                    started = now
+                    self.heuristic_path = self.tour.nodes()
+                    self.saveCheckpoint(self.checkpoint, queue, better)
+                    nextCheckpoint = now + self.checkpointEvery
+
+            self.iterations += 1
+            t1 = queue.popleft()
+            active[t1] = False
+
+            # Moves from a node also depend on edges away from it, so once
+            # the queue is empty check every node again until a whole pass
+            # finds no improvement
+            if not queue and better:
+                better = False
+                if recorder is not None:
+                    self._endPass()
+                for node in self.tour.nodes():
+                    if node != t1:
+                        active[node] = True
+                        queue.append(node)
+
+            if recorder is None:
+                improved = self.improve(t1)
+            else:
+                began = time.perf_counter()
+                improved = self.improve(t1)
+                recorder.count("improve")
+                recorder.count("improve_seconds", time.perf_counter() - began)
 
-        # Similarly, if not every node has a successor, this can not work
-        if len(successors) < self.size:
-            return False, []
+            if improved:
+                better = True
 
-        succ = successors[0]
-        new_tour = [0]
-        visited = set(new_tour)
+                # Wake up the endpoints of every changed edge, t1 included, and
+                # look at them first to keep the search local
+                for node in self.changed:
+                    if not active[node]:
+                        active[node] = True
+                        queue.appendleft(node)
 
-        # If we already encountered a node it means we have a loop
-        while succ not in visited:
-            visited.add(succ)
-            new_tour.append(succ)
-            succ = successors[succ]
+                # Accepted moves are never undone
+                del self.tour.log[:]
 
-        # If we visited all nodes without a loop we have a tour
-        return len(new_tour) == self.size, new_tour
+        if recorder is not None:
+            self._endPass()
 
+        self.seconds += time.perf_counter() - started
+        self.complete = not queue
+        self.heuristic_path = self.tour.nodes()
 
-class KOpt(TSP):
-    """
-    K-opt move for the TSP, will become Lin-Kernighan.
-    """
+        if self.checkpoint is not None:
+            self.saveCheckpoint(self.checkpoint, queue, better)
 
-    def _optimise(self):
+        # Keep the best tour so far, but not in the route memo unless it is a
+        # local optimum
+        if self.complete:
+            self.save(self.heuristic_path, self.heuristic_cost)
+
+    def _mark(self):
+        """
+        Remember the state at the start of a pass.
+        """
+        counters = self.recorder.counters
+        self.passMark = (time.perf_counter(), self.heuristic_cost,
+                         counters["improve"], counters["accepted"],
+                         self.evaluated)
+
+    def _endPass(self):
         """
-        Global loop which restarts at each improving solution.
+        Report the pass which ends, a pass ends when the queue of active
+        nodes is seeded again or when the search stops.
         """
-        better = True
-        self.solutions = set()
+        started, cost, improve, accepted, evaluated = self.passMark
+        counters = self.recorder.counters
 
-        # Rebuild the neighbours
-        self.neighbours = {}
+        self.recorder.emit(
+            "pass", index=self.passes, seconds=time.perf_counter() - started,
+            gain=float(cost - self.heuristic_cost),
+            tried=counters["improve"] - improve,
+            accepted=counters["accepted"] - accepted,
+            evaluated=self.evaluated - evaluated,
+            cost=float(self.heuristic_cost))
 
-        for i in self.heuristic_path:
-            self.neighbours[i] = []
+        self.passes += 1
+        self._mark()
 
-            for j, dist in enumerate(TSP.edges[i]):
-                if dist > 0 and j in self.heuristic_path:
-                    self.neighbours[i].append(j)
+    def broken(self, i, j, k):
+        """
+        Check if the edge (i, j) is one of the k edges removed so far, that
+        is (t_1, t_2), ..., (t_2k-1, t_2k).
+        """
+        t = self.t
 
-        # Restart the loop each time we find an improving candidate
-        while better:
-            better = self.improve()
-            # Paths always begin at 0 so this should manage to find duplicate
-            # solutions
-            self.solutions.add(str(self.heuristic_path))
-            print(self.heuristic_cost)
+        for n in range(1, 2 * k, 2):
+            if (t[n] == i and t[n + 1] == j) or (t[n] == j and t[n + 1] == i):
+                return True
 
-        self.save(self.heuristic_path, self.heuristic_cost)
+        return False
 
-    def closest(self, t2i, tour, gain, broken, joined):
+    def joined(self, i, j, k):
+        """
+        Check if the edge (i, j) is one of the k edges added so far, that is
+        (t_2, t_3), ..., (t_2k, t_2k+1).
+        """
+        t = self.t
+
+        for n in range(2, 2 * k + 1, 2):
+            if (t[n] == i and t[n + 1] == j) or (t[n] == j and t[n + 1] == i):
+                return True
+
+        return False
+
+    def closest(self, t2i, tour, gain, k):
         """
         Find the closest neighbours of a node ordered by potential gain.  As a
         side-effect, also compute the partial improvement of joining a node.
@@ -190,35 +354,33 @@ class KOpt(TSP):
 
             - gain: current gain
 
-            - broken: set of edges to remove (X)
-
-            - joined: set of edges to join (Y)
+            - k: number of edges removed so far (X), k - 1 were added (Y)
 
         Return: sorted list of neighbours based on potential improvement with
         next omission
         """
         # Select t_2i + 1
         neighbours = {}
+        self.evaluated += len(self.neighbours[t2i])
 
         # Create the neighbours of t_2i
-        for node in self.neighbours[t2i]:
-            yi = makePair(t2i, node)
-            Gi = gain - TSP.dist(t2i, node)
+        for node, cost in self.neighbours[t2i]:
+            Gi = gain - cost
 
             # Any new edge has to have a positive running sum, not be a broken
-            # edge and not belong to the tour.
-            if Gi <= 0 or yi in broken or tour.contains(yi):
+            # or joined edge and not belong to the tour.
+            if Gi <= 0 or tour.contains(t2i, node) or \
+                    self.broken(t2i, node, k) or self.joined(t2i, node, k - 1):
                 continue
 
             for succ in tour.around(node):
-                xi = makePair(node, succ)
-
                 # TODO verify it is enough, but we do check if the tour is
                 # valid first thing in `chooseX` so this should be sufficient
                 #
                 # Check that "x_i+1 exists"
-                if xi not in broken and xi not in joined:
-                    diff = TSP.dist(node, succ) - TSP.dist(t2i, node)
+                if not self.broken(node, succ, k) and \
+                        not self.joined(node, succ, k - 1):
+                    diff = self.dist(node, succ) - cost
 
                     if node in neighbours and diff > neighbours[node][0]:
                         neighbours[node][0] = diff
@@ -228,47 +390,54 @@ class KOpt(TSP):
         # Sort the neighbours by potential gain
         return sorted(neighbours.items(), key=lambda x: x[1][0], reverse=True)
 
-    def improve(self):
+    def improve(self, t1):
         """
-        Start the LKH algorithm with the current tour.
+        Start the LKH algorithm from `t1` with the current tour.
+
+        Return: whether an improving move was applied, the nodes of its edges
+        are left in `self.changed`
         """
-        tour = Tour(self.heuristic_path)
+        tour = self.tour
+        around = tour.around(t1)
+        self.t[1] = t1
 
         # Find all valid 2-opt moves and try them
-        for t1 in self.heuristic_path:
-            around = tour.around(t1)
+        for t2 in around:
+            self.t[2] = t2
+            # Initial savings
+            gain = self.dist(t1, t2)
 
-            for t2 in around:
-                broken = set([makePair(t1, t2)])
-                # Initial savings
-                gain = TSP.dist(t1, t2)
+            close = self.closest(t2, tour, gain, 1)
 
-                close = self.closest(t2, tour, gain, broken, set())
+            # Number of neighbours to try
+            tries = self.tries
 
-                # Number of neighbours to try
-                tries = 5
+            for t3, (_, Gi) in close:
+                # Make sure that the new node is none of t_1's neighbours
+                # so it does not belong to the tour.
+                if t3 in around:
+                    continue
 
-                for t3, (_, Gi) in close:
-                    # Make sure that the new node is none of t_1's neighbours
-                    # so it does not belong to the tour.
-                    if t3 in around:
-                        continue
+                self.t[3] = t3
 
-                    joined = set([makePair(t2, t3)])
+                if self.chooseX(tour, t1, t3, Gi, 1):
+                    if self.recorder is not None:
+                        # Rank of the t3 which led to the move, to tune tries
+                        self.recorder.count(
+                            "t3_rank{}".format(self.tries - tries))
 
-                    if self.chooseX(tour, t1, t3, Gi, broken, joined):
-                        # Return to Step 2, that is the initial loop
-                        return True
-                    # Else try the other options
+                    # Return to Step 2, that is the queue of active nodes
+                    return True
+                # Else try the other options
 
-                    tries -= 1
-                    # Explored enough nodes, change t_2
-                    if tries == 0:
-                        break
+                tries -= 1
+                # Explored enough nodes, change t_2
+                if tries == 0:
+                    break
 
         return False
 
-    def chooseX(self, tour, t1, last, gain, broken, joined):
+    def chooseX(self, tour, t1, last, gain, k):
         """
         Choose an edge to omit from the tour.
 
@@ -278,21 +447,23 @@ class KOpt(TSP):
 
             - t1: starting node for the current k-opt
 
-            - last: tail of the last edge added (t_2i-1)
+            - last: tail of the last edge added (t_2k+1)
 
             - gain: current gain (Gi)
 
-            - broken: potential edges to remove (X)
-
-            - joined: potential edges to add (Y)
+            - k: number of edges removed (X) and added (Y) so far
 
         Return: whether we found an improved tour
         """
-        if len(broken) == 4:
+        # Stack of t_i nodes is full
+        if k == self.maxDepth:
+            return False
+
+        if k == 4:
             pred, succ = tour.around(last)
 
             # Give priority to the longest edge for x_4
-            if TSP.dist(pred, last) > TSP.dist(succ, last):
+            if self.dist(pred, last) > self.dist(succ, last):
                 around = [pred]
             else:
                 around = [succ]
@@ -300,43 +471,35 @@ class KOpt(TSP):
             around = tour.around(last)
 
         for t2i in around:
-            xi = makePair(last, t2i)
             # Gain at current iteration
-            Gi = gain + TSP.dist(last, t2i)
+            Gi = gain + self.dist(last, t2i)
 
             # Verify that X and Y are disjoint, though I also need to check
             # that we are not including an x_i again for some reason.
-            if xi not in joined and xi not in broken:
-                added = deepcopy(joined)
-                removed = deepcopy(broken)
-
-                removed.add(xi)
-                added.add(makePair(t2i, t1))  # Try to relink the tour
+            if not self.joined(last, t2i, k) and \
+                    not self.broken(last, t2i, k):
+                self.t[2 * k + 2] = t2i
 
-                relink = Gi - TSP.dist(t2i, t1)
-                is_tour, new_tour = tour.generate(removed, added)
+                # Try to relink the tour
+                relink = Gi - self.dist(t2i, t1)
+                is_tour = self.closes(tour, k + 1)
 
                 # The current solution does not form a valid tour
-                if not is_tour and len(added) > 2:
+                if not is_tour and k + 1 > 2:
                     continue
 
-                # Stop the search if we come back to the same solution
-                if str(new_tour) in self.solutions:
-                    return False
-
                 # Save the current solution if the tour is better, we need
                 # `is_tour` again in the case where we have a non-sequential
                 # exchange with i = 2
-                if is_tour and relink > 0:
-                    self.heuristic_path = new_tour
-                    self.heuristic_cost -= relink
+                if is_tour and relink > self.epsilon:
+                    self.apply(tour, k + 1, relink)
 
                     return True
                 else:
                     # Pass on the newly "removed" edge but not the relink
-                    choice = self.chooseY(tour, t1, t2i, Gi, removed, joined)
+                    choice = self.chooseY(tour, t1, t2i, Gi, k + 1)
 
-                    if len(broken) == 2 and choice:
+                    if k + 1 == 2 and choice:
                         return True
                     else:
                         # Single iteration for i > 2
@@ -344,7 +507,7 @@ class KOpt(TSP):
 
         return False
 
-    def chooseY(self, tour, t1, t2i, gain, broken, joined):
+    def chooseY(self, tour, t1, t2i, gain, k):
         """
         Choose an edge to add to the new tour.
 
@@ -354,32 +517,28 @@ class KOpt(TSP):
 
             - t1: starting node for the current k-opt
 
-            - t2i: tail of the last edge removed (t_2i)
+            - t2i: tail of the last edge removed (t_2k)
 
             - gain: current gain (Gi)
 
-            - broken: potential edges to remove (X)
-
-            - joined: potential edges to add (Y)
+            - k: number of edges removed so far (X), k - 1 were added (Y)
 
         Return: whether we found an improved tour
         """
-        ordered = self.closest(t2i, tour, gain, broken, joined)
+        ordered = self.closest(t2i, tour, gain, k)
 
-        if len(broken) == 2:
-            # Check the five nearest neighbours when i = 2
-            top = 5
+        if k == 2:
+            # Check several neighbours when i = 2
+            top = self.breadth
         else:
             # Otherwise the closest only
             top = 1
 
         for node, (_, Gi) in ordered:
-            yi = makePair(t2i, node)
-            added = deepcopy(joined)
-            added.add(yi)
+            self.t[2 * k + 1] = node
 
             # Stop at the first improving tour
-            if self.chooseX(tour, t1, node, Gi, broken, added):
+            if self.chooseX(tour, t1, node, Gi, k):
                 return True
 
             top -= 1
@@ -389,6 +548,38 @@ class KOpt(TSP):
 
         return False
 
+    def closes(self, tour, k):
+        """
+        Check if the sequential move on the stack, closed with (t_2k, t_1),
+        gives a tour.  The closing edge may not duplicate another edge.
+        """
+        t = self.t
+        t1 = t[1]
+        t2k = t[2 * k]
+
+        if self.joined(t2k, t1, k - 1) or \
+                (tour.contains(t2k, t1) and not self.broken(t2k, t1, k)):
+            return False
+
+        return tour.feasible(t, k)
+
+    def apply(self, tour, k, gain):
+        """
+        Apply the improving k-opt move on the stack to the current tour, the
+        nodes of its edges are left in `self.changed`.
+        """
+        tour.makeMove(self.t, k, gain)
+        self.heuristic_cost -= gain
+        self.changed = self.t[1:2 * k + 1]
+
+        if self.recorder is not None:
+            self.recorder.count("accepted")
+            self.recorder.count("accepted_k{}".format(k))
+            self.recorder.count("gain", gain)
+            self.recorder.emit("move", k=k, gain=float(gain),
+                               cost=float(self.heuristic_cost))
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
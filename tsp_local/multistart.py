@@ -0,0 +1,349 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tsp_local.base import TSP
+from tsp_local.bound import HeldKarp, gap as relativeGap
+from tsp_local.candidates import candidateSet
+from tsp_local.construct import construct
+from tsp_local.context import SolverContext
+from tsp_local.greedy import Greedy
+from tsp_local.instrument import Recorder
+from tsp_local.kopt import KOpt
+from tsp_local.store import BufferStore, DenseStore, QuantisedStore
+from tsp_local.twoopt import NumpyTwoOpt
+
+KINDS = ("random", "greedy", "nearest", "greedy-edge", "hilbert")
+STORES = ("flat", "quantised", "dense")
+POLISH_CANDIDATES = 10  # Candidate neighbours of the polishing 2-opt
+
+# Shared memory, distance store over it and solver context of the searches,
+# set up once by every worker process
+_shared = None
+_store = None
+_context = None
+
+
+def _attach(name, size, dtype, unit, store, coordinates, candidates):
+    """
+    Map the shared cost matrix in a worker process, without copying it, and
+    build the context every search of the process runs in.  The candidate
+    lists come from the parent process, so no worker builds a private copy
+    of the matrix (or the alpha-nearness matrix) to compute them.
+    """
+    global _shared, _store, _context
+
+    _shared = shared_memory.SharedMemory(name=name)
+    dtype = np.dtype(dtype)
+
+    if store == "dense":
+        _store = DenseStore(np.ndarray((size, size), dtype=dtype,
+                                       buffer=_shared.buf))
+    else:
+        values = _shared.buf[:size * size * dtype.itemsize].cast(dtype.char)
+        _store = BufferStore(values, size, dtype, unit)
+
+    _context = SolverContext(_store, coordinates=coordinates)
+    _context.candidates = candidates
+
+
+def _candidateKinds(solver, solverOptions, polish):
+    """
+    (kind, count) of the candidate lists the searches build over every node:
+    those of KOpt and its subclasses, of the `candidates` option of ThreeOpt
+    and NumpyTwoOpt, and of the polish.
+    """
+    kinds = []
+
+    if hasattr(solver, "candidateKind"):
+        kinds.append((solver.candidateKind, solver.candidateCount))
+    elif solverOptions.get("candidates") is not None:
+        kinds.append(("nearest", solverOptions["candidates"]))
+    if polish:
+        kinds.append(("nearest", POLISH_CANDIDATES))
+
+    return kinds
+
+
+def initialTour(kind, nodes, rng, context=None):
+    """
+    Build a starting tour.
+
+    Parameters:
+
+        - kind: "random" for a random permutation, "greedy" for the greedy
+          heuristic from the first node, "nearest" for nearest neighbour
+          from a random node, "greedy-edge" or "hilbert" (needs the
+          coordinates of the context), see tsp_local.construct
+
+        - nodes: nodes to visit
+
+        - rng: random.Random instance
+
+        - context: SolverContext, the default one if None
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> TSP.setEdges(hexagon)
+    >>> sorted(initialTour("random", range(6), random.Random(1)))
+    [0, 1, 2, 3, 4, 5]
+    >>> initialTour("nearest", range(6), random.Random(1))
+    [1, 0, 5, 4, 3, 2]
+    """
+    nodes = list(nodes)
+
+    if kind == "random":
+        rng.shuffle(nodes)
+        return nodes
+    elif kind == "greedy":
+        greedy = Greedy(nodes, context=context)
+        greedy._optimise()
+        return greedy.heuristic_path
+    elif kind == "nearest":
+        return construct(kind, nodes, rng.choice(nodes), context)
+    elif kind in ("greedy-edge", "hilbert"):
+        return construct(kind, nodes, context=context)
+    else:
+        raise ValueError("unknown start {!r}, expected one of {}".format(
+            kind, KINDS))
+
+
+def _solve(task):
+    """
+    Run one independent search in a worker process.
+    """
+    index, kind, seed, solver, nodes, options = task
+    started = time.perf_counter()
+
+    recorder = None
+    if options["record"]:
+        recorder = Recorder(profile=options["profile"])
+    # The context of the process, its route memo is emptied for every search
+    # as the searches of a run all visit the same nodes
+    context = _context
+    context.recorder = None
+    context.routes.clear()
+
+    # Budget and checkpoint, only for the solvers which support them
+    budget = dict(options["solverOptions"])
+    if options["deadline"] is not None:
+        budget["timeLimit"] = max(options["deadline"] - time.time(), 0.)
+    if options["checkpoints"] is not None:
+        budget["checkpoint"] = os.path.join(
+            options["checkpoints"], "start{}.json".format(index))
+    if options["gap"] is not None:
+        budget["gap"] = options["gap"]
+        budget["bound"] = options["bound"]
+
+    if "checkpoint" in budget and os.path.exists(budget["checkpoint"]):
+        context.recorder = recorder
+        search = solver.resume(budget["checkpoint"], context, **budget)
+    else:
+        path = initialTour(kind, nodes, random.Random(seed), context)
+        # The start visits the same nodes as the search, the memo would
+        # return its route
+        context.routes.clear()
+        context.recorder = recorder
+        search = solver(path, context=context, **budget)
+
+    path, cost = search.optimise()
+    complete = getattr(search, "complete", True)
+    polished = 0.
+
+    # Not past the budget: an incomplete search has run out of time
+    if options["polish"] and complete:
+        polish = NumpyTwoOpt(path, candidates=POLISH_CANDIDATES,
+                             context=context)
+        # Not through optimise(), the memo holds the route of the search
+        polish._optimise()
+        polished = float(cost - polish.heuristic_cost)
+        path, cost = polish.heuristic_path, polish.heuristic_cost
+
+    stats = {
+        "start": index,
+        "kind": kind,
+        "seed": seed,
+        "pid": os.getpid(),
+        "initial_cost": float(search.initial_cost),
+        "cost": float(cost),
+        "seconds": time.perf_counter() - started,
+        "complete": complete,
+    }
+
+    if options["polish"]:
+        stats["polish_gain"] = polished
+
+    if options["bound"] is not None:
+        stats["gap"] = relativeGap(float(cost), options["bound"])
+
+    if recorder is not None:
+        stats["counters"] = dict(recorder.counters)
+        stats["events"] = recorder.events
+
+    return path, cost, stats
+
+
+def multiStart(matrix, starts=None, workers=None, seed=0, solver=KOpt,
+               kinds=("greedy", "nearest"), record=False, profile=None,
+               timeLimit=None, checkpoints=None, coordinates=None, gap=None,
+               bound=None, solverOptions=None, store="flat", polish=False):
+    """
+    Run independent searches from different starting tours in a process
+    pool.  The cost matrix is put once in shared memory and mapped by every
+    worker instead of being pickled with each task.
+
+    Parameters:
+
+        - matrix: square cost matrix
+
+        - starts: number of searches, one per CPU by default
+
+        - workers: number of processes, one per CPU by default
+
+        - seed: seed of the random starts, search i uses seed + i
+
+        - solver: TSP subclass to run from every start
+
+        - kinds: kinds of starting tours, see `initialTour`, the first one
+          is used for the first search and the last one for all the others
+
+        - record: instrument the searches, their counters and events are
+          added to the statistics
+
+        - profile: "cpu" or "memory" to also profile the searches, see
+          tsp_local.instrument.Recorder
+
+        - timeLimit: seconds from now until every search stops with its best
+          tour so far, the solver needs a `timeLimit` option (KOpt)
+
+        - checkpoints: directory where every search saves itself regularly,
+          a search with a checkpoint there resumes from it instead of
+          starting over, the solver needs `checkpoint` and `resume` (KOpt)
+
+        - coordinates: (lat, lng) of the nodes, for the "hilbert" starts and
+          the "quadrant" candidates
+
+        - gap: every search stops once its tour is within this fraction of
+          the lower bound, the solver needs a `gap` option (KOpt)
+
+        - bound: lower bound of the tour length, computed once here with
+          tsp_local.bound.HeldKarp if None and a gap is given.  With a bound
+          the statistics give the gap of every search
+
+        - solverOptions: other options of the solver, for instance the
+          number of kicks of tsp_local.iterated.IteratedKOpt
+
+        - store: distance store of the searches over the shared matrix,
+          "flat" for lookups in a float64 buffer, "quantised" to share int32
+          costs instead (half the memory, see
+          tsp_local.store.QuantisedStore) or "dense" to index a 2-D array
+
+        - polish: finish every complete search with a vectorised 2-opt pass
+          over the POLISH_CANDIDATES nearest neighbours of every node
+          (tsp_local.twoopt.NumpyTwoOpt), its gain goes to the statistics
+
+    Return: (best path, best cost, statistics of every search)
+
+    >>> from tsp_local.threeopt import hexagon
+    >>> path, cost, stats = multiStart(hexagon, starts=3, workers=2)
+    >>> cost, len(stats), [s["kind"] for s in stats]
+    (6.0, 3, ['greedy', 'nearest', 'nearest'])
+    >>> _, _, stats = multiStart(hexagon, starts=1, workers=1, record=True)
+    >>> stats[0]["events"][-1]["event"], stats[0]["counters"]["improve"] > 0
+    ('solve', True)
+
+    A search which runs out of time returns its best tour so far.
+    >>> _, cost, stats = multiStart(hexagon, starts=1, kinds=("random",),
+    ...                             timeLimit=0)
+    >>> stats[0]["complete"], cost == stats[0]["initial_cost"]
+    (False, True)
+
+    >>> _, cost, stats = multiStart(hexagon, starts=1, gap=0.)
+    >>> cost, stats[0]["gap"]
+    (6.0, 0.0)
+
+    >>> from tsp_local.iterated import IteratedKOpt
+    >>> _, cost, _ = multiStart(hexagon, starts=1, solver=IteratedKOpt,
+    ...                         solverOptions={"kicks": 10})
+    >>> cost
+    6.0
+
+    >>> multiStart(hexagon, starts=2, store="quantised")[1]
+    6.0
+
+    >>> from tsp_local.twoopt import TwoOpt
+    >>> _, cost, stats = multiStart(hexagon, starts=1, solver=TwoOpt,
+    ...                             kinds=("random",), polish=True)
+    >>> cost, stats[0]["polish_gain"]
+    (6.0, 0.0)
+    """
+    if store not in STORES:
+        raise ValueError("unknown store {!r}, expected one of {}".format(
+            store, STORES))
+
+    matrix = np.ascontiguousarray(matrix, dtype=float)
+    starts = starts or os.cpu_count() or 1
+    workers = min(workers or os.cpu_count() or 1, starts)
+    nodes = list(range(len(matrix)))
+    if gap is not None and bound is None:
+        bound = HeldKarp(matrix).bound
+    options = {
+        "record": bool(record or profile),
+        "profile": profile,
+        # Wall clock, shared by the processes
+        "deadline": None if timeLimit is None else time.time() + timeLimit,
+        "checkpoints": checkpoints,
+        "gap": gap,
+        "bound": bound,
+        "solverOptions": solverOptions or {},
+        "polish": polish,
+    }
+
+    if checkpoints is not None:
+        os.makedirs(checkpoints, exist_ok=True)
+
+    tasks = []
+    for i in range(starts):
+        kind = kinds[min(i, len(kinds) - 1)]
+        tasks.append((i, kind, seed + i, solver, nodes, options))
+
+    values, unit, costs = matrix, None, matrix
+    if store == "quantised":
+        costs = QuantisedStore(matrix)
+        values = np.frombuffer(costs.values, dtype=np.int32)
+        unit = costs.unit
+
+    # Candidate lists over the costs the workers see, computed once here
+    # instead of in every search
+    parent = SolverContext(costs, coordinates=coordinates)
+    for kind, count in _candidateKinds(solver, options["solverOptions"],
+                                       polish):
+        candidateSet(nodes, kind, count, parent)
+
+    shared = shared_memory.SharedMemory(create=True,
+                                        size=max(values.nbytes, 1))
+
+    try:
+        view = np.ndarray(values.shape, dtype=values.dtype, buffer=shared.buf)
+        view[:] = values
+        del view
+
+        with ProcessPoolExecutor(
+                workers, initializer=_attach,
+                initargs=(shared.name, len(matrix), values.dtype.str, unit,
+                          store, coordinates, parent.candidates)) as pool:
+            results = list(pool.map(_solve, tasks))
+    finally:
+        shared.close()
+        shared.unlink()
+
+    path, cost, _ = min(results, key=lambda r: r[1])
+    return path, float(cost), [stats for _, _, stats in results]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
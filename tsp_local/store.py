@@ -0,0 +1,380 @@
+import math
+import os
+from abc import ABCMeta, abstractmethod
+from array import array
+
+import numpy as np
+
+KINDS = ("dense", "flat", "quantised", "mmap")
+
+
+class DistanceStore(metaclass=ABCMeta):
+    """
+    Cost matrix behind a SolverContext.  `dist` is the scalar lookup of the
+    local searches, `row`, `submatrix` and `matrix` give NumPy arrays to the
+    vectorised code.  `store[i][j]` also works, through the rows.
+    """
+
+    size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        return self.row(i)
+
+    @abstractmethod
+    def dist(self, i, j):
+        """
+        Cost from node i to node j.
+        """
+        pass
+
+    @abstractmethod
+    def row(self, i):
+        """
+        Costs from node i to every node, as a float array.
+        """
+        pass
+
+    def submatrix(self, nodes):
+        """
+        Costs between some nodes, rows and columns in the order of `nodes`.
+        """
+        nodes = list(nodes)
+        if len(nodes) == 0:
+            return np.zeros((0, 0))
+
+        return np.array([self.row(i)[nodes] for i in nodes], dtype=float)
+
+    def matrix(self):
+        """
+        The whole matrix, every row is read.
+        """
+        return self.submatrix(range(self.size))
+
+
+class DenseStore(DistanceStore):
+    """
+    Any matrix indexed as matrix[i][j]: nested lists or a 2-D array, its
+    values are returned as they are.
+
+    >>> from tsp_local.twoopt import cross
+    >>> s = DenseStore(cross)
+    >>> s.dist(0, 2), s[0][2], s.submatrix([2, 0]).tolist()
+    (3, 3, [[0.0, 3.0], [3.0, 0.0]])
+    """
+
+    def __init__(self, matrix):
+        self.edges = matrix
+        self.size = len(matrix)
+
+    def __getitem__(self, i):
+        return self.edges[i]
+
+    def dist(self, i, j):
+        return self.edges[i][j]
+
+    def row(self, i):
+        return np.asarray(self.edges[i], dtype=float)
+
+    def submatrix(self, nodes):
+        return np.asarray(self.edges, dtype=float)[np.ix_(nodes, nodes)]
+
+    def matrix(self):
+        return np.asarray(self.edges, dtype=float)
+
+
+class BufferStore(DistanceStore):
+    """
+    Row-major matrix in a flat buffer: a lookup is one index into a Python
+    array or memoryview, which returns a Python number, instead of two NumPy
+    scalar indexings.  Float64 rows and matrices are read-only views on the
+    buffer, other types are converted (and scaled by `unit`).
+    """
+
+    def __init__(self, values, size, dtype, unit=None):
+        """
+        Parameters:
+
+            - values: size * size costs in row-major order, any object
+              indexed by position and exposing the buffer protocol
+
+            - size: number of nodes
+
+            - dtype: NumPy type of the values
+
+            - unit: cost of one step of integer values, see QuantisedStore
+        """
+        self.values = values
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self.unit = unit
+
+        if unit is not None:
+            self.dist = self._scaled
+
+    def dist(self, i, j):
+        return self.values[i * self.size + j]
+
+    def _scaled(self, i, j):
+        return self.values[i * self.size + j] * self.unit
+
+    def _view(self, count, offset=0):
+        """
+        Read-only array over `count` values of the buffer from `offset`.
+        """
+        view = np.frombuffer(self.values, self.dtype, count,
+                             offset * self.dtype.itemsize)
+        view.flags.writeable = False
+        return view
+
+    def _float(self, values):
+        """
+        Values of the buffer as float64: the array itself if it already is
+        one, else converted or scaled.
+        """
+        if self.unit is not None:
+            return values * self.unit
+        elif values.dtype != np.float64:
+            return values.astype(float)
+
+        return values
+
+    def row(self, i):
+        return self._float(self._view(self.size, i * self.size))
+
+    def submatrix(self, nodes):
+        nodes = np.asarray(nodes, dtype=int)
+        # Only the selected rows and columns are read and copied
+        matrix = self._view(self.size * self.size).reshape(self.size,
+                                                           self.size)
+        return self._float(matrix[np.ix_(nodes, nodes)])
+
+    def matrix(self):
+        return self._float(self._view(self.size * self.size)
+                           .reshape(self.size, self.size))
+
+
+class FlatStore(BufferStore):
+    """
+    Costs as a flat `array('d')`, the same memory as a float64 matrix.
+
+    >>> from tsp_local.twoopt import cross
+    >>> s = FlatStore(cross)
+    >>> s.dist(0, 2), s.row(1).tolist()
+    (3.0, [2.0, 0.0, 2.0, 3.0])
+    """
+
+    def __init__(self, matrix):
+        matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+        values = array("d")
+        values.frombytes(matrix.tobytes())
+        super().__init__(values, len(matrix), np.float64)
+
+
+class QuantisedStore(BufferStore):
+    """
+    Costs rounded to a multiple of `unit` and kept as int32, half the
+    memory of float64.  The lookups return the rounded costs.
+
+    >>> s = QuantisedStore([[0, 1.3], [1.3, 0]], unit=0.5)
+    >>> s.dist(0, 1), s.matrix().tolist()
+    (1.5, [[0.0, 1.5], [1.5, 0.0]])
+    >>> QuantisedStore([[0, 1.25], [1.25, 0]]).dist(0, 1)
+    1.25
+    >>> QuantisedStore([[0, np.nan], [np.nan, 0]])
+    Traceback (most recent call last):
+    ...
+    ValueError: costs are not all finite, 2 NaN or infinite
+    """
+
+    limit = 2 ** 31 - 1
+
+    def __init__(self, matrix, unit=None):
+        """
+        Parameters:
+
+            - matrix: square cost matrix
+
+            - unit: cost of one step, the smallest power of two which fits
+              the largest cost in int32 if None, integer costs stay exact
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+
+        # NaN (unreachable pairs) would be stored as the smallest int32
+        if not np.isfinite(matrix).all():
+            raise ValueError("costs are not all finite, {} NaN or infinite"
+                             .format(int((~np.isfinite(matrix)).sum())))
+
+        largest = float(np.abs(matrix).max()) if matrix.size else 0.
+
+        if unit is None:
+            unit = 2. ** math.ceil(math.log2(largest / self.limit)) \
+                if largest > 0 else 1.
+        if largest / unit > self.limit:
+            raise ValueError("costs up to {} do not fit in int32 steps of {}"
+                             .format(largest, unit))
+
+        values = array("i")
+        values.frombytes(np.rint(matrix / unit).astype(np.int32).tobytes())
+        super().__init__(values, len(matrix), np.int32, unit)
+
+
+class MmapStore(BufferStore):
+    """
+    Float64 matrix of a .npy file mapped in memory, the system pages in the
+    rows which are read, for matrices larger than the memory.
+
+    >>> import os, tempfile
+    >>> from tsp_local.twoopt import cross
+    >>> path = os.path.join(tempfile.mkdtemp(), "cross.npy")
+    >>> np.save(path, np.array(cross, dtype=float))
+    >>> with MmapStore(path) as s:
+    ...     s.dist(0, 2), s.submatrix([3, 1]).tolist()
+    (3.0, [[0.0, 3.0], [3.0, 0.0]])
+
+    A matrix already mapped by np.load is used as it is, not mapped again.
+    >>> MmapStore(np.load(path, mmap_mode="r")).row(1).tolist()
+    [2.0, 0.0, 2.0, 3.0]
+    """
+
+    def __init__(self, matrix):
+        """
+        Parameters:
+
+            - matrix: path of a .npy file, or a matrix loaded with
+              np.load(..., mmap_mode="r")
+        """
+        if isinstance(matrix, (str, os.PathLike)):
+            matrix = np.load(matrix, mmap_mode="r")
+
+        if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1] or \
+                matrix.dtype != np.dtype("<f8") or \
+                not matrix.flags.c_contiguous:
+            raise ValueError("{} is not a square float64 matrix in C order"
+                             .format(getattr(matrix, "filename", "matrix")))
+
+        # The lookups index a flat view of the mapped array
+        self.array = matrix
+        super().__init__(memoryview(matrix.reshape(-1)), matrix.shape[0],
+                         np.float64)
+
+    def close(self):
+        """
+        Release the view of the file, it is unmapped once no other array
+        uses it.  The store can not be read after.
+        """
+        self.values.release()
+        self.array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        self.close()
+
+
+class LazyStore(DistanceStore):
+    """
+    Rows computed the first time they are read, for instance by a Dijkstra
+    search from the node, and kept.  A search over some nodes of a large
+    network only computes their rows.
+
+    >>> calls = []
+    >>> def load(i):
+    ...     calls.append(i)
+    ...     return [abs(i - j) for j in range(5)]
+    >>> s = LazyStore(5, load)
+    >>> s.dist(3, 0), s.submatrix([1, 3]).tolist(), sorted(calls)
+    (3.0, [[0.0, 2.0], [2.0, 0.0]], [1, 3])
+    >>> s.loaded
+    2
+    """
+
+    def __init__(self, size, load, typecode="d"):
+        """
+        Parameters:
+
+            - size: number of nodes
+
+            - load: function returning the costs from a node to every node
+
+            - typecode: array typecode of the rows, "i" for instance for
+              a predecessor table
+        """
+        self.size = size
+        self.load = load
+        self.typecode = typecode
+        self.rows = [None] * size
+
+    def __getitem__(self, i):
+        row = self.rows[i]
+        return row if row is not None else self._row(i)
+
+    def _row(self, i):
+        row = self.rows[i] = array(self.typecode, self.load(i))
+        return row
+
+    def dist(self, i, j):
+        row = self.rows[i]
+        if row is None:
+            row = self._row(i)
+        return row[j]
+
+    def row(self, i):
+        row = self.rows[i]
+        if row is None:
+            row = self._row(i)
+        return np.frombuffer(row, dtype=row.typecode).astype(float)
+
+    @property
+    def loaded(self):
+        """
+        Number of rows computed so far.
+        """
+        return sum(row is not None for row in self.rows)
+
+
+def makeStore(edges, kind=None, **options):
+    """
+    Distance store over a cost matrix.
+
+    Parameters:
+
+        - edges: cost matrix, or a DistanceStore which is returned as it is
+          when no kind is given
+
+        - kind: "dense" to index the matrix as it is, "flat" for a flat
+          float64 buffer, "quantised" for int32 steps (option `unit`),
+          "mmap" for a .npy file mapped in memory (`edges` is its path or a
+          matrix loaded with np.load(..., mmap_mode="r")), "dense" if None
+
+    >>> from tsp_local.twoopt import cross
+    >>> [type(makeStore(cross, kind)).__name__ for kind in KINDS[:3]]
+    ['DenseStore', 'FlatStore', 'QuantisedStore']
+    """
+    if kind is None:
+        if isinstance(edges, DistanceStore):
+            return edges
+        kind = "dense"
+
+    if isinstance(edges, DistanceStore):
+        edges = edges.matrix()
+
+    if kind == "dense":
+        return DenseStore(edges, **options)
+    elif kind == "flat":
+        return FlatStore(edges, **options)
+    elif kind == "quantised":
+        return QuantisedStore(edges, **options)
+    elif kind == "mmap":
+        return MmapStore(edges, **options)
+    else:
+        raise ValueError("unknown store {!r}, expected one of {}".format(
+            kind, KINDS))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
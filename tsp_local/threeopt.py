@@ -1,4 +1,8 @@
+import numpy as np
+
 from tsp_local.base import TSP
+from tsp_local.candidates import candidateSet
+from tsp_local.tour import makeTour
 
 # Start with an obvious exchange
 start = [0, 3, 2, 4, 5, 1]
@@ -11,7 +15,61 @@ hexagon = [[0, 1, 3, 3, 3, 1],
            [1, 3, 3, 3, 1, 0]]  # yapf: disable
 
 
-def exchange(path, execute, a, c, e):
+# Edges added by each of the seven reconnections, given by the roles of their
+# nodes: 0 to 5 stand for a, b, c, d, e, f
+cases = [((0, 4), (2, 3), (1, 5)),
+         ((0, 1), (2, 4), (3, 5)),
+         ((0, 2), (1, 3), (4, 5)),
+         ((0, 3), (4, 2), (1, 5)),
+         ((0, 3), (4, 1), (2, 5)),
+         ((0, 4), (3, 1), (2, 5)),
+         ((0, 2), (1, 4), (3, 5))]  # yapf: disable
+
+
+def gain(path, execute, a, c, e, dist=None):
+    """
+    Gain of a reconnection given three edges to swap, without building the
+    new path.  Costs are given by `dist`, the default context if None.
+
+    >>> TSP.setEdges(hexagon)
+    >>> [gain(start, i, 0, 2, 4) for i in range(7)]
+    [2, 0, 2, 0, 2, 6, 0]
+    """
+    dist = dist or TSP.dist
+    nodes = [path[i] for i in (a, a + 1, c, c + 1, e, e + 1)]
+    base = dist(nodes[0], nodes[1]) + dist(nodes[2], nodes[3]) + \
+        dist(nodes[4], nodes[5])
+
+    for i, j in cases[execute]:
+        base -= dist(nodes[i], nodes[j])
+
+    return base
+
+
+def gains(matrix, path, a, c, e):
+    """
+    Gains of the seven reconnections for arrays of edges at once, as a 7 x
+    len(e) array.
+
+    >>> import numpy as np
+    >>> gains(np.array(hexagon), np.array(start), 0, 2, np.array([4]))[:, 0]
+    array([2, 0, 2, 0, 2, 6, 0])
+    """
+    nodes = [path[i] for i in (a, a + 1, c, c + 1, e, e + 1)]
+    base = matrix[nodes[0], nodes[1]] + matrix[nodes[2], nodes[3]] + \
+        matrix[nodes[4], nodes[5]]
+    out = []
+
+    for edges in cases:
+        added = base
+        for i, j in edges:
+            added = added - matrix[nodes[i], nodes[j]]
+        out.append(added)
+
+    return np.array(out)
+
+
+def exchange(path, execute, a, c, e, dist=None):
     """
     Reconnects the path given three edges to swap.
 
@@ -33,40 +91,63 @@ def exchange(path, execute, a, c, e):
     """
     b, d, f = a + 1, c + 1, e + 1
 
-    p_a, p_b, p_c, p_d, p_e, p_f = [path[i] for i in (a, b, c, d, e, f)]
-
-    base = TSP.dist(p_a, p_b) + TSP.dist(p_c, p_d) + TSP.dist(p_e, p_f)
-
     if execute == 0:
         # 2-opt (a, e) [d, c] (b, f)
         sol = path[:a + 1] + path[e:d - 1:-1] + path[c:b - 1:-1] + path[f:]
-        gain = TSP.dist(p_a, p_e) + TSP.dist(p_c, p_d) + TSP.dist(p_b, p_f)
     elif execute == 1:
         # 2-opt [a, b] (c, e) (d, f)
         sol = path[:a + 1] + path[b:c + 1] + path[e:d - 1:-1] + path[f:]
-        gain = TSP.dist(p_a, p_b) + TSP.dist(p_c, p_e) + TSP.dist(p_d, p_f)
     elif execute == 2:
         # 2-opt (a, c) (b, d) [e, f]
         sol = path[:a + 1] + path[c:b - 1:-1] + path[d:e + 1] + path[f:]
-        gain = TSP.dist(p_a, p_c) + TSP.dist(p_b, p_d) + TSP.dist(p_e, p_f)
     elif execute == 3:
         # 3-opt (a, d) (e, c) (b, f)
         sol = path[:a + 1] + path[d:e + 1] + path[c:b - 1:-1] + path[f:]
-        gain = TSP.dist(p_a, p_d) + TSP.dist(p_e, p_c) + TSP.dist(p_b, p_f)
     elif execute == 4:
         # 3-opt (a, d) (e, b) (c, f)
         sol = path[:a + 1] + path[d:e + 1] + path[b:c + 1] + path[f:]
-        gain = TSP.dist(p_a, p_d) + TSP.dist(p_e, p_b) + TSP.dist(p_c, p_f)
     elif execute == 5:
         # 3-opt (a, e) (d, b) (c, f)
         sol = path[:a + 1] + path[e:d - 1:-1] + path[b:c + 1] + path[f:]
-        gain = TSP.dist(p_a, p_e) + TSP.dist(p_d, p_b) + TSP.dist(p_c, p_f)
     elif execute == 6:
         # 3-opt (a, c) (b, e) (d, f)
         sol = path[:a + 1] + path[c:b - 1:-1] + path[e:d - 1:-1] + path[f:]
-        gain = TSP.dist(p_a, p_c) + TSP.dist(p_b, p_e) + TSP.dist(p_d, p_f)
 
-    return sol, base - gain
+    return sol, gain(path, execute, a, c, e, dist)
+
+
+def sequential(path, execute, a, c, e):
+    """
+    Nodes t_1, ..., t_2k of a reconnection as a sequential k-opt move, see
+    `Tour.makeMove`, edges both removed and added are left out.
+
+    >>> sequential(start, 5, 0, 2, 4)
+    ([None, 0, 3, 4, 2, 1, 5], 3)
+    >>> sequential(start, 1, 0, 2, 4)
+    ([None, 2, 4, 1, 5], 2)
+    """
+    removed = [(0, 1), (2, 3), (4, 5)]
+    added = [tuple(sorted(edge)) for edge in cases[execute]]
+    kept = [edge for edge in removed if edge in added]
+    out, back = {}, {}
+
+    for i, j in removed:
+        if (i, j) not in kept:
+            out[i], out[j] = j, i
+    for i, j in added:
+        if (i, j) not in kept:
+            back[i], back[j] = j, i
+
+    # Walk the alternating cycle of removed and added edges
+    nodes = [path[i] for i in (a, a + 1, c, c + 1, e, e + 1)]
+    t = [None]
+    role = min(out)
+
+    for _ in range(len(out) // 2):
+        t += [nodes[role], nodes[out[role]]]
+        role = back[out[role]]
+
+    return t, len(out) // 2
 
 
 class ThreeOpt(TSP):
@@ -81,8 +162,38 @@ class ThreeOpt(TSP):
     >>> t._optimise()
     >>> t.heuristic_cost
     6
+
+    Only moves joining candidate neighbours, evaluated with NumPy.
+    >>> t = ThreeOpt(range(6), candidates=2, vectorised=True)
+    >>> t.heuristic_path = start
+    >>> t._optimise()
+    >>> t.heuristic_cost
+    6
     """
 
+    epsilon = 1e-9  # Smallest accepted gain, rounding errors could cycle
+
+    def __init__(self, nodes, fast=False, candidates=None, vectorised=False,
+                 context=None):
+        """
+        Parameters:
+
+            - nodes: nodes in the scenario
+
+            - fast: apply the first improving move instead of the best one
+
+            - candidates: only try the triples where the first node gets an
+              edge to one of this many candidate neighbours, all if None
+
+            - vectorised: evaluate the inner loop over the third edge with
+              NumPy
+
+            - context: SolverContext, the default one if None
+        """
+        super().__init__(nodes, fast, context)
+        self.candidates = candidates
+        self.vectorised = vectorised
+
     def _optimise(self):
         """
         U.S. test.
@@ -99,21 +210,64 @@ class ThreeOpt(TSP):
         >>> t.heuristic_cost < t.pathCost(l)
         True
         """
-        bestPath = self.heuristic_path
-        bestCost = self.pathCost(self.heuristic_path)
+        # Reconnections are applied as k-opt moves on the tour, the scan
+        # reads its nodes in order
+        tour = makeTour(self.heuristic_path, self.context)
+        bestPath = tour.nodes()
+        bestCost = self.pathCost(bestPath)
         bestChange = 1
-        size = len(self.heuristic_path)
+        size = len(bestPath)
+
+        if self.candidates is not None:
+            self.neighbours = candidateSet(bestPath, "nearest",
+                                           self.candidates, self.context)
+        if self.vectorised:
+            self.matrix = self.context.matrix()
 
         while bestChange > 0:
             saved, bestChange = self._improve(bestPath, size)
 
             if bestChange > 0:
                 a, c, e, which = saved
-                bestPath, change = exchange(bestPath, which, a, c, e)
+                t, k = sequential(bestPath, which, a, c, e)
+                change = gain(bestPath, which, a, c, e, self.dist)
+                tour.makeMove(t, k, change)
+                bestPath = tour.nodes()
                 bestCost -= change
 
         self.save(bestPath, bestCost)
 
+    def _triples(self, path, size):
+        """
+        Pairs (a, c) with the range of e to try.  With candidates, the node at
+        a has to get an edge to one of its neighbours at c, d = c + 1 or e.
+        """
+        if self.candidates is None:
+            for a in range(size - 5):
+                for c in range(a + 2, size - 3):
+                    yield a, c, range(c + 2, size - 1)
+            return
+
+        position = {node: i for i, node in enumerate(path)}
+
+        for a in range(size - 5):
+            seen = set()
+
+            for node, _ in self.neighbours[path[a]]:
+                j = position[node]
+
+                # Neighbour at c or d, any e
+                for c in (j, j - 1):
+                    if a + 2 <= c < size - 3 and c not in seen:
+                        seen.add(c)
+                        yield a, c, range(c + 2, size - 1)
+
+                # Neighbour at e, any c not seen yet
+                if a + 4 <= j < size - 1:
+                    for c in range(a + 2, j - 1):
+                        if c not in seen:
+                            yield a, c, range(j, j + 1)
+
     def _improve(self, bestPath, size):
         """
         Breakable improvement loop, find an improving move and return to the
@@ -121,25 +275,65 @@ class ThreeOpt(TSP):
         improving move or the best.
         """
         saved = None
-        bestChange = 0
+        bestChange = self.epsilon
+
+        if self.vectorised:
+            path = np.asarray(bestPath)
+        dist = self.dist
 
         # Choose 3 unique edges defined by their first node
-        for a in range(size - 5):
-            for c in range(a + 2, size - 3):
-                for e in range(c + 2, size - 1):
-                    change = 0
-                    # Now we have seven (sic) permutations to check
-                    for i in range(7):
-                        # TODO improve this...
-                        path, change = exchange(bestPath, i, a, c, e)
-
-                        if change > bestChange:
-                            saved = a, c, e, i
-                            bestChange = change
-
-                            # Cut short if fast
-                            if self.fast:
-                                return saved, bestChange
+        for a, c, around in self._triples(bestPath, size):
+            # Seven reconnections for every e
+            self.evaluated += 7 * len(around)
+
+            if self.vectorised:
+                if len(around) == 0:
+                    continue
+
+                e = np.arange(around.start, around.stop)
+                change = gains(self.matrix, path, a, c, e)
+                which, best = np.unravel_index(np.argmax(change),
+                                               change.shape)
+
+                if change[which, best] > bestChange:
+                    saved = a, c, int(e[best]), int(which)
+                    bestChange = change[which, best]
+
+                    if self.fast:
+                        return saved, bestChange
+                continue
+
+            # Distances which do not depend on e
+            p_a, p_b, p_c, p_d = bestPath[a], bestPath[a + 1], \
+                bestPath[c], bestPath[c + 1]
+            ab, cd, ac, bd, ad = dist(p_a, p_b), dist(p_c, p_d), \
+                dist(p_a, p_c), dist(p_b, p_d), dist(p_a, p_d)
+
+            for e in around:
+                p_e, p_f = bestPath[e], bestPath[e + 1]
+                ae, bf, ce, df = dist(p_a, p_e), dist(p_b, p_f), \
+                    dist(p_c, p_e), dist(p_d, p_f)
+                ef, be, cf = dist(p_e, p_f), dist(p_b, p_e), dist(p_c, p_f)
+                base = ab + cd + ef
+
+                # Now we have seven (sic) permutations to check, same order
+                # as `cases`
+                for i, added in enumerate((ae + cd + bf, ab + ce + df,
+                                           ac + bd + ef, ad + ce + bf,
+                                           ad + be + cf, ae + bd + cf,
+                                           ac + be + df)):
+                    change = base - added
+
+                    if change > bestChange:
+                        saved = a, c, e, i
+                        bestChange = change
+
+                        # Cut short if fast
+                        if self.fast:
+                            return saved, bestChange
+
+        if saved is None:
+            return None, 0
 
         return saved, bestChange
 
@@ -0,0 +1,467 @@
+from tsp_local.base import TSP
+
+KINDS = ("array", "two-level")
+TWO_LEVEL_SIZE = 8000  # Tours from this many nodes are two-level lists
+
+
+def makeTour(tour, context=None, kind=None):
+    """
+    Build the tour structure of a search.
+
+    Parameters:
+
+        - tour: nodes in tour order
+
+        - context: SolverContext giving the tour length and the tour kind,
+          the default one if None
+
+        - kind: "array" or "two-level", the kind of the context if None, and
+          if that is None too it is chosen from the size of the tour:
+          reversing an array costs O(n), a two-level list O(sqrt(n)) but
+          every query is slower
+
+    >>> TSP.setEdges([[1] * 6] * 6)  # Dummy matrix
+    >>> type(makeTour([0, 1, 2])).__name__
+    'Tour'
+    >>> type(makeTour([0, 1, 2], kind="two-level")).__name__
+    'TwoLevelTour'
+    >>> from tsp_local.context import SolverContext
+    >>> c = SolverContext([[1] * 3] * 3, tourKind="two-level")
+    >>> type(makeTour([0, 1, 2], c)).__name__
+    'TwoLevelTour'
+    """
+    context = context if context is not None else TSP.context
+    kind = kind if kind is not None else context.tourKind
+
+    if kind is None:
+        kind = "two-level" if len(tour) >= TWO_LEVEL_SIZE else "array"
+
+    if kind == "array":
+        return Tour(tour, context)
+    elif kind == "two-level":
+        from tsp_local.twolevel import TwoLevelTour
+        return TwoLevelTour(tour, context)
+
+    raise ValueError("unknown tour {!r}, expected one of {}".format(kind,
+                                                                   KINDS))
+
+
+class TourBase():
+    """
+    Interface of the tours the searches move on.  Implementations give the
+    neighbours of a node, an order key along the tour, path reversals and
+    their undo; feasibility checks and k-opt moves are built on them.
+
+        - next(node), prev(node): successor and predecessor
+
+        - sequence(node): key increasing along the tour from some node, it
+          changes with every reversal
+
+        - distance(a, b): number of steps forward from a to b
+
+        - flip(a, b): reverse the path walked forward from a to b, logged for
+          `undo`
+
+        - undo(mark): undo the flips logged after `mark`
+
+        - nodes(): list of the nodes in tour order
+
+    and the attributes `size`, `span` (width of the node range), `length` and
+    `log`.
+    """
+
+    def contains(self, i, j):
+        """
+        Check if the edge (i, j) belongs to the tour.
+        """
+        return self.next(i) == j or self.prev(i) == j
+
+    def around(self, node):
+        """
+        Return the predecessor and successor of the current node.
+
+        Parameters:
+
+            - node: node to look around
+
+        Return: (pred, succ)
+        """
+        return (self.prev(node), self.next(node))
+
+    def between(self, a, b, c):
+        """
+        Check if `b` is met when walking the tour forward from `a` to `c`,
+        both included.
+
+        >>> TSP.setEdges([[1] * 6] * 6)  # Dummy matrix
+        >>> t = Tour([0, 1, 2, 3, 4, 5])
+        >>> t.between(1, 2, 4), t.between(1, 5, 4), t.between(4, 0, 1)
+        (True, False, True)
+        >>> t.between(4, 2, 1), t.between(3, 3, 3)
+        (False, True)
+        """
+        a = self.sequence(a)
+        b = self.sequence(b)
+        c = self.sequence(c)
+
+        if a <= c:
+            return a <= b <= c
+        else:
+            return b >= a or b <= c
+
+    def _split(self, t, k):
+        """
+        Split the tour at the removed edges of a sequential k-opt move.
+
+        Segment j starts after the j-th removed edge along the tour and ends
+        before the next one, slot 2j is its start and slot 2j + 1 its end.
+
+        Return: (segments, mate), segments as (first node, last node) and the
+        slot linked to every slot by an added edge
+        """
+        # Removed edges oriented along the tour, sorted by sequence
+        edges = []
+
+        for i in range(1, k + 1):
+            a, b = t[2 * i - 1], t[2 * i]
+            forward = self.next(a) == b
+            if not forward:
+                a, b = b, a
+            edges.append((self.sequence(a), i, a, b, forward))
+
+        edges.sort()
+
+        first = [0] * (k + 1)  # Slot of t_2i-1
+        second = [0] * (k + 1)  # Slot of t_2i
+        segments = []
+
+        for j, (_, i, _, b, forward) in enumerate(edges):
+            tail = 2 * j - 1 if j > 0 else 2 * k - 1
+            if forward:
+                first[i], second[i] = tail, 2 * j
+            else:
+                first[i], second[i] = 2 * j, tail
+            segments.append((b, edges[(j + 1) % k][2]))
+
+        # Added edges link the slots of t_2i and t_2i+1
+        mate = [0] * (2 * k)
+
+        for i in range(1, k + 1):
+            nxt = first[i + 1] if i < k else first[1]
+            mate[second[i]] = nxt
+            mate[nxt] = second[i]
+
+        return segments, mate
+
+    def feasible(self, t, k):
+        """
+        Check if the sequential k-opt move given by its nodes gives a tour, in
+        O(k log k) without building it.  Edges (t_1, t_2), ..., (t_2k-1, t_2k)
+        are removed, (t_2, t_3), ..., (t_2k-2, t_2k-1) and (t_2k, t_1) added.
+
+        Parameters:
+
+            - t: nodes of the move, t[0] is unused
+
+            - k: number of removed edges
+
+        Test optimal 2-opt and an invalid one
+        >>> from tsp_local.twoopt import cross, start
+        >>> TSP.setEdges(cross)
+        >>> t = Tour(start)
+        >>> t.feasible([None, 0, 2, 3, 1], 2), t.feasible([None, 0, 2, 1, 3], 2)
+        (True, False)
+
+        Test disjoint and optimal 3-opt
+        >>> from tsp_local.threeopt import hexagon, start
+        >>> TSP.setEdges(hexagon)
+        >>> t = Tour(start)
+        >>> t.feasible([None, 0, 3, 4, 5], 2)
+        False
+        >>> t.feasible([None, 0, 3, 4, 2, 1, 5], 3)
+        True
+        """
+        # A 2-opt move reverses a path, the second edge has to be removed
+        # the other way around
+        if k == 2:
+            return (self.next(t[1]) == t[2]) == (self.prev(t[3]) == t[4])
+
+        _, mate = self._split(t, k)
+
+        # Walk the segments, the move is a tour if all of them are visited
+        # before coming back to the start
+        slot = 0
+        count = 0
+
+        while True:
+            slot = mate[slot ^ 1]
+            count += 1
+            if slot == 0 or count > k:
+                break
+
+        return count == k
+
+    def _arrangement(self, segments, anchor, target):
+        """
+        Current cyclic order of the segments, read from the anchor segment
+        walked forward, as a list of (segment, forward).  A single node
+        anchor has no direction, it is then read the way closest to target.
+
+        Return: (order, first and last node of every segment along the tour,
+        mirrored)
+        """
+        ends = []
+        low = []
+        placed = []
+
+        for n, (first, last, length, second) in enumerate(segments):
+            # Segments are only moved whole, one walked backwards does not
+            # reach its second node
+            forward = length == 1 or self.next(first) == second
+            ends.append((first, last) if forward else (last, first))
+            low.append(self.sequence(ends[-1][0]))
+            placed.append((n, forward))
+
+        origin = low[anchor]
+        placed.sort(key=lambda x: (low[x[0]] < origin, low[x[0]]))
+        # Walk the tour backwards when the anchor is reversed
+        backwards = [(n, not forward or segments[n][2] == 1)
+                     for n, forward in placed[:1] + placed[:0:-1]]
+
+        if segments[anchor][2] > 1:
+            mirrored = not placed[0][1]
+        else:
+            matched = [next((p for p in range(len(order))
+                             if order[p] != target[p]), len(order))
+                       for order in (placed, backwards)]
+            mirrored = matched[1] > matched[0]
+
+        return backwards if mirrored else placed, ends, mirrored
+
+    def makeMove(self, t, k, gain):
+        """
+        Apply a feasible sequential k-opt move in place, with at most 2k
+        path reversals.  Nodes and edges are as in `feasible`.
+
+        Parameters:
+
+            - t: nodes of the move, t[0] is unused
+
+            - k: number of removed edges
+
+            - gain: improvement of the tour length
+
+        Test optimal 3-opt
+        >>> from tsp_local.threeopt import hexagon, start
+        >>> TSP.setEdges(hexagon)
+        >>> t = Tour(start)
+        >>> t.makeMove([None, 0, 3, 4, 2, 1, 5], 3, 6)
+        >>> t.length, TSP.pathCost(t.nodes())
+        (6, 6)
+        """
+        segments, mate = self._split(t, k)
+        segments = [(first, last, self.distance(first, last) + 1,
+                     self.next(first)) for first, last in segments]
+
+        # Order of the segments in the new tour, entering a segment by its
+        # start slot means walking it forward
+        target = []
+        slot = 0
+
+        for _ in range(k):
+            n = slot // 2
+            target.append((n, slot % 2 == 0 or segments[n][2] == 1))
+            slot = mate[slot ^ 1]
+
+        # Read it from the longest segment, walked forward
+        anchor = max(range(k), key=lambda n: segments[n][2])
+        at = [n for n, _ in target].index(anchor)
+        target = target[at:] + target[:at]
+
+        if not target[0][1]:
+            target = [(n, not forward or segments[n][2] == 1)
+                      for n, forward in target[:1] + target[:0:-1]]
+
+        # Bring the right segment, in the right direction, at the first
+        # position which differs
+        while True:
+            order, ends, mirrored = self._arrangement(segments, anchor,
+                                                      target)
+
+            if order == target:
+                break
+
+            p = next(p for p in range(k) if order[p] != target[p])
+            q = next(q for q in range(p, k) if order[q][0] == target[p][0])
+
+            if mirrored:
+                first, last = order[q][0], order[p][0]
+            else:
+                first, last = order[p][0], order[q][0]
+
+            self.flip(ends[first][0], ends[last][1])
+
+        self.length -= gain
+
+
+class Tour(TourBase):
+    """
+    Class to represent a tour in LKH.
+
+    Nodes are indices, the tour keeps a position, successor and predecessor
+    array so that every neighbourhood query is a constant time lookup.
+    """
+
+    def __init__(self, tour, context=None):
+        """
+        Parameters:
+
+            - tour: nodes in tour order
+
+            - context: SolverContext giving the tour length, the default one
+              if None
+        """
+        context = context if context is not None else TSP.context
+        self.tour = list(tour)
+        self.size = len(self.tour)
+        self.length = context.pathCost(self.tour)
+        self._makeArrays()
+        # Reversals since the last mark, see `undo`
+        self.log = []
+
+    def _makeArrays(self):
+        """
+        Create the position, successor and predecessor arrays, indexed by
+        node. Nodes which are not part of the tour are marked with -1.
+
+        >>> TSP.setEdges([[1] * 6] * 6)  # Dummy matrix
+        >>> t = Tour([1, 3, 2, 5, 4])
+        >>> t.position
+        [-1, 0, 2, 1, 4, 3]
+        >>> t.succ
+        [-1, 3, 5, 2, 1, 4]
+        >>> t.pred
+        [-1, 4, 3, 1, 5, 2]
+        """
+        # Width of the node range, the arrays are indexed by node
+        self.span = max(self.tour) + 1 if self.size > 0 else 0
+        self.position = [-1] * self.span
+        self.succ = [-1] * self.span
+        self.pred = [-1] * self.span
+
+        for i, node in enumerate(self.tour):
+            self.position[node] = i
+            self.succ[node] = self.tour[i + 1 - self.size]
+            self.pred[node] = self.tour[i - 1]
+
+    def at(self, i):
+        return self.tour[i]
+
+    def index(self, i):
+        """
+        Return the index of a node in a tour.
+        """
+        return self.position[i]
+
+    def next(self, node):
+        return self.succ[node]
+
+    def prev(self, node):
+        return self.pred[node]
+
+    def sequence(self, node):
+        return self.position[node]
+
+    def distance(self, a, b):
+        return (self.position[b] - self.position[a]) % self.size
+
+    def nodes(self):
+        return list(self.tour)
+
+    def contains(self, i, j):
+        """
+        Check if the edge (i, j) belongs to the tour.
+        """
+        return self.succ[i] == j or self.pred[i] == j
+
+    def around(self, node):
+        """
+        Return the predecessor and successor of the current node.
+        """
+        return (self.pred[node], self.succ[node])
+
+    def feasible(self, t, k):
+        if k == 2:
+            return (self.succ[t[1]] == t[2]) == (self.pred[t[3]] == t[4])
+
+        return super().feasible(t, k)
+
+    def flip(self, a, b):
+        """
+        Reverse the path walked forward from `a` to `b`.
+
+        >>> TSP.setEdges([[1] * 6] * 6)  # Dummy matrix
+        >>> t = Tour([0, 1, 2, 3, 4, 5])
+        >>> t.flip(4, 0); t.tour
+        [4, 1, 2, 3, 0, 5]
+        """
+        self.reverse(self.position[a], self.position[b])
+
+    def reverse(self, i, j):
+        """
+        Reverse the tour between positions i and j, both included and
+        wrapping around the end.  The shortest side is reversed, which gives
+        the same cycle, and the reversal is logged for `undo`.
+
+        >>> TSP.setEdges([[1] * 6] * 6)  # Dummy matrix
+        >>> t = Tour([0, 1, 2, 3, 4, 5])
+        >>> t.reverse(1, 2); t.tour
+        [0, 2, 1, 3, 4, 5]
+        >>> t.reverse(4, 0); t.tour
+        [4, 2, 1, 3, 0, 5]
+        >>> t.succ[5], t.pred[5], t.position[4]
+        (4, 0, 0)
+        """
+        size = self.size
+        length = (j - i) % size + 1
+
+        # Reverse the complement instead, it is the same cycle
+        if 2 * length > size:
+            i, j = (j + 1) % size, (i - 1) % size
+            length = size - length
+
+        self.log.append((i, j))
+        tour = self.tour
+
+        for m in range(length // 2):
+            a = (i + m) % size
+            b = (j - m) % size
+            tour[a], tour[b] = tour[b], tour[a]
+
+        # Fix the arrays inside the segment and around it
+        for m in range(-1, length + 1):
+            p = (i + m) % size
+            node = tour[p]
+            self.position[node] = p
+            self.succ[node] = tour[p + 1 - size]
+            self.pred[node] = tour[p - 1]
+
+    def undo(self, mark=0):
+        """
+        Undo the reversals logged after `mark`, a previous length of the log.
+
+        >>> TSP.setEdges([[1] * 6] * 6)  # Dummy matrix
+        >>> t = Tour([0, 1, 2, 3, 4, 5])
+        >>> t.reverse(1, 2); mark = len(t.log); t.reverse(3, 4)
+        >>> t.undo(mark); t.tour
+        [0, 2, 1, 3, 4, 5]
+        """
+        while len(self.log) > mark:
+            i, j = self.log.pop()
+            self.reverse(i, j)
+            self.log.pop()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
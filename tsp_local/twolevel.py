@@ -0,0 +1,288 @@
+import math
+
+from tsp_local.base import TSP
+from tsp_local.tour import TourBase
+
+
+class TwoLevelTour(TourBase):
+    """
+    Two-level doubly-linked list, as in LKH: the tour is cut into about
+    sqrt(n) segments, each with a reversed bit and a rank in the list of
+    segments, and every node knows its segment and its index in it.
+
+    Successor, predecessor and order queries are constant time.  Reversing a
+    path splits the segments at its ends, then reverses the order of the
+    segments in between and flips their bits, in O(sqrt(n)).  Splits leave
+    short segments behind, the segments are cut again once there are twice
+    as many as at the start.
+
+    >>> TSP.setEdges([[1] * 10] * 10)  # Dummy matrix
+    >>> t = TwoLevelTour(range(10), groupSize=3)
+    >>> t.next(2), t.prev(0), t.between(8, 1, 2)
+    (3, 9, True)
+    >>> t.flip(2, 7); t.nodes()
+    [0, 1, 7, 6, 5, 4, 3, 2, 8, 9]
+    >>> t.next(1), t.next(2), t.prev(7), t.distance(7, 8)
+    (7, 8, 1, 6)
+    >>> t.undo(); t.nodes()
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+    """
+
+    def __init__(self, tour, context=None, groupSize=None):
+        """
+        Parameters:
+
+            - tour: nodes in tour order
+
+            - context: SolverContext giving the tour length, the default one
+              if None
+
+            - groupSize: nodes in a segment, sqrt(n) if None
+        """
+        context = context if context is not None else TSP.context
+        tour = list(tour)
+        self.size = len(tour)
+        self.length = context.pathCost(tour)
+        # Width of the node range, the arrays are indexed by node
+        self.span = max(tour) + 1 if self.size > 0 else 0
+        self.groupSize = groupSize or max(int(math.sqrt(self.size)), 1)
+        self.seg = [-1] * self.span
+        self.idx = [-1] * self.span
+        self._build(tour)
+        # Reversals since the last mark, see `undo`
+        self.log = []
+
+    def _build(self, tour):
+        """
+        Cut the tour into segments of `groupSize` nodes.
+
+        >>> TSP.setEdges([[1] * 6] * 6)  # Dummy matrix
+        >>> t = TwoLevelTour([1, 3, 2, 5, 4], groupSize=2)
+        >>> t.segNodes, t.order, t.seg
+        ([[1, 3], [2, 5], [4]], [0, 1, 2], [-1, 0, 1, 0, 2, 1])
+        """
+        size = self.groupSize
+        # Nodes of every segment in its own direction, the tour walks them
+        # backwards when the segment is reversed
+        self.segNodes = [tour[i:i + size] for i in range(0, len(tour), size)]
+        self.segRev = [False] * len(self.segNodes)
+        self.segRank = list(range(len(self.segNodes)))
+        self.order = list(range(len(self.segNodes)))
+        self.limit = 2 * len(self.segNodes) + 2
+
+        for s, nodes in enumerate(self.segNodes):
+            for i, node in enumerate(nodes):
+                self.seg[node] = s
+                self.idx[node] = i
+
+    def next(self, node):
+        s = self.seg[node]
+        i = self.idx[node]
+
+        if self.segRev[s]:
+            if i:
+                return self.segNodes[s][i - 1]
+        else:
+            nodes = self.segNodes[s]
+            if i + 1 < len(nodes):
+                return nodes[i + 1]
+
+        # First node of the next segment
+        order = self.order
+        s = order[(self.segRank[s] + 1) % len(order)]
+        return self.segNodes[s][-1 if self.segRev[s] else 0]
+
+    def prev(self, node):
+        s = self.seg[node]
+        i = self.idx[node]
+
+        if self.segRev[s]:
+            nodes = self.segNodes[s]
+            if i + 1 < len(nodes):
+                return nodes[i + 1]
+        elif i:
+            return self.segNodes[s][i - 1]
+
+        # Last node of the previous segment
+        s = self.order[self.segRank[s] - 1]
+        return self.segNodes[s][0 if self.segRev[s] else -1]
+
+    def around(self, node):
+        return (self.prev(node), self.next(node))
+
+    def contains(self, i, j):
+        return self.next(i) == j or self.prev(i) == j
+
+    def _offset(self, node):
+        """
+        Index of a node in its segment, along the tour.
+        """
+        s = self.seg[node]
+        if self.segRev[s]:
+            return len(self.segNodes[s]) - 1 - self.idx[node]
+        return self.idx[node]
+
+    def sequence(self, node):
+        s = self.seg[node]
+        if self.segRev[s]:
+            return (self.segRank[s] + 1) * self.size - 1 - self.idx[node]
+        return self.segRank[s] * self.size + self.idx[node]
+
+    def distance(self, a, b):
+        """
+        Number of steps forward from `a` to `b`, in O(sqrt(n)).
+        """
+        sa, sb = self.seg[a], self.seg[b]
+        oa, ob = self._offset(a), self._offset(b)
+
+        if sa == sb and ob >= oa:
+            return ob - oa
+
+        steps = len(self.segNodes[sa]) - oa
+        count = len(self.order)
+        r = (self.segRank[sa] + 1) % count
+
+        while self.order[r] != sb:
+            steps += len(self.segNodes[self.order[r]])
+            r = (r + 1) % count
+
+        return steps + ob
+
+    def nodes(self):
+        tour = []
+
+        for s in self.order:
+            if self.segRev[s]:
+                tour.extend(reversed(self.segNodes[s]))
+            else:
+                tour.extend(self.segNodes[s])
+
+        return tour
+
+    def _splitBefore(self, node):
+        """
+        Split the segment of a node so that the node starts a segment along
+        the tour.  The part which does not start the segment's own list moves
+        to a new segment, it is re-indexed.
+
+        >>> TSP.setEdges([[1] * 6] * 6)  # Dummy matrix
+        >>> t = TwoLevelTour(range(6), groupSize=3)
+        >>> t._splitBefore(1); t.segNodes, t.order
+        ([[0], [3, 4, 5], [1, 2]], [0, 2, 1])
+        >>> t.nodes()
+        [0, 1, 2, 3, 4, 5]
+        """
+        s = self.seg[node]
+        nodes = self.segNodes[s]
+        reversed_ = self.segRev[s]
+        cut = self.idx[node] + 1 if reversed_ else self.idx[node]
+
+        if cut == 0 or cut == len(nodes):
+            return
+
+        moved = nodes[cut:]
+        del nodes[cut:]
+        new = len(self.segNodes)
+        self.segNodes.append(moved)
+        self.segRev.append(reversed_)
+        self.segRank.append(0)
+
+        for i, n in enumerate(moved):
+            self.seg[n] = new
+            self.idx[n] = i
+
+        # The moved part comes first along the tour if the segment is walked
+        # backwards
+        rank = self.segRank[s] + (0 if reversed_ else 1)
+        self.order.insert(rank, new)
+
+        for r in range(rank, len(self.order)):
+            self.segRank[self.order[r]] = r
+
+    def _reverse(self, a, b):
+        """
+        Reverse the path walked forward from `a` to `b`.
+        """
+        after = self.next(b)
+        if after == a:
+            # The whole tour, it is the same cycle
+            return
+
+        self._splitBefore(a)
+        self._splitBefore(after)
+
+        order = self.order
+        count = len(order)
+        i = self.segRank[self.seg[a]]
+        j = self.segRank[self.seg[b]]
+        length = (j - i) % count + 1
+
+        for m in range(length // 2):
+            p, q = (i + m) % count, (j - m) % count
+            order[p], order[q] = order[q], order[p]
+
+        for m in range(length):
+            p = (i + m) % count
+            s = order[p]
+            self.segRank[s] = p
+            self.segRev[s] = not self.segRev[s]
+
+    def flip(self, a, b):
+        """
+        Reverse the path walked forward from `a` to `b`, or the rest of the
+        tour if it holds fewer segments, which gives the same cycle.  The
+        reversal is logged for `undo`.
+
+        >>> TSP.setEdges([[1] * 8] * 8)  # Dummy matrix
+        >>> t = TwoLevelTour(range(8), groupSize=2)
+        >>> t.flip(2, 3); t.nodes()
+        [0, 1, 3, 2, 4, 5, 6, 7]
+
+        Here the rest of the tour is shorter, so it is reversed instead.
+        >>> t.flip(1, 6); t.nodes()
+        [7, 1, 3, 2, 4, 5, 6, 0]
+        """
+        if a == b or self.next(b) == a:
+            self.log.append(None)
+            return
+
+        after = self.next(b)
+        self._splitBefore(a)
+        self._splitBefore(after)
+
+        count = len(self.order)
+        length = (self.segRank[self.seg[b]] - self.segRank[self.seg[a]]) % \
+            count + 1
+
+        if 2 * length > count:
+            a, b = after, self.prev(a)
+
+        self._reverse(a, b)
+        # The path now runs from b to a
+        self.log.append((b, a))
+
+        if len(self.order) > self.limit:
+            self._build(self.nodes())
+
+    def undo(self, mark=0):
+        """
+        Undo the reversals logged after `mark`, a previous length of the log.
+
+        >>> TSP.setEdges([[1] * 8] * 8)  # Dummy matrix
+        >>> t = TwoLevelTour(range(8), groupSize=3)
+        >>> t.flip(1, 2); mark = len(t.log); t.flip(3, 6); t.flip(0, 4)
+        >>> t.undo(mark); t.nodes()
+        [0, 2, 1, 3, 4, 5, 6, 7]
+        """
+        while len(self.log) > mark:
+            path = self.log.pop()
+            if path is not None:
+                self._reverse(*path)
+
+        if len(self.order) > self.limit:
+            self._build(self.nodes())
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
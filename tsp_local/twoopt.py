@@ -1,4 +1,8 @@
+import numpy as np
+
 from tsp_local.base import TSP
+from tsp_local.candidates import candidateSet
+from tsp_local.tour import makeTour
 
 # Cross circuit with obvious 2-opt
 # A   B    A - B
@@ -56,30 +60,43 @@ class TwoOpt(TSP):
         >>> t._optimise()
         >>> t.heuristic_cost < t.pathCost(l)
         True
+
+        The same moves on a two-level list.
+        >>> from tsp_local.context import SolverContext
+        >>> u = TwoOpt(l, context=SolverContext(matrix, tourKind="two-level"))
+        >>> u._optimise()
+        >>> u.heuristic_cost == u.pathCost(u.heuristic_path) < t.pathCost(l)
+        True
         """
         bestChange = -1
-        bestPath = self.heuristic_path
-        size = len(bestPath)
+        # Moves reverse paths of the tour, the scan walks it from its first
+        # node with `next`, whichever structure holds it
+        tour = makeTour(self.heuristic_path, self.context)
+        size = len(self.heuristic_path)
 
-        while bestChange < 0:
-            saved, bestChange = self._improve(bestPath, size)
+        while bestChange < 0 and size > 0:
+            saved, bestChange = self._improve(tour, self.heuristic_path[0],
+                                              size)
 
             if bestChange < 0:
-                i, j = saved  # `i` is the last element in place
-                bestPath = swap(bestPath, i + 1, j)
+                k, j = saved  # Reverse from the node after `i` up to `j`
+                tour.flip(k, j)
 
+        bestPath = tour.nodes()
         self.save(bestPath, self.pathCost(bestPath))
 
-    def _improve(self, bestPath, size):
+    def _improve(self, tour, first, size):
         bestChange = 0
         saved = None
+        i = first
 
         for n in range(size - 3):
+            self.evaluated += max(size - n - 3, 0)
+            k = tour.next(i)
+            j = tour.next(k)
+
             for m in range(n + 2, size - 1):
-                i = bestPath[n]
-                j = bestPath[m]
-                k = bestPath[n + 1]
-                l = bestPath[m + 1]
+                l = tour.next(j)
 
                 # Replacement arcs are:
                 #  * i -> k => i -> j
@@ -89,16 +106,164 @@ class TwoOpt(TSP):
 
                 if change < bestChange:
                     bestChange = change
-                    saved = (n, m)
+                    saved = (k, j)
 
                     # If fast, we return the first improving move
                     if self.fast:
                         return saved, bestChange
                     # Otherwise, we explore all possible moves
 
+                j = l
+
+            i = k
+
         return saved, bestChange
 
 
+class NumpyTwoOpt(TwoOpt):
+    """
+    Vectorised 2-opt: the gains of every pair of edges, or only of the pairs
+    joining candidate neighbours, are computed in one NumPy expression and
+    the segment is reversed in place on an integer array.
+
+    Cross optimisation
+    >>> TSP.setEdges(cross)
+    >>> t = NumpyTwoOpt(range(4))
+    >>> t.heuristic_path = start
+    >>> t.heuristic_cost = 10
+    >>> t._optimise()
+    >>> t.heuristic_path, t.heuristic_cost
+    ([0, 1, 2, 3], 8)
+    """
+
+    epsilon = 1e-9  # Smallest accepted gain, rounding errors could cycle
+
+    def __init__(self, nodes, fast=False, candidates=None, context=None):
+        """
+        Parameters:
+
+            - nodes: nodes in the scenario
+
+            - fast: apply the first improving move instead of the best one
+
+            - candidates: only try moves adding an edge to one of this many
+              candidate neighbours, all pairs of edges if None
+
+            - context: SolverContext, the default one if None
+        """
+        super().__init__(nodes, fast, context)
+        self.candidates = candidates
+
+    def _optimise(self):
+        """
+        Hexagon with candidate neighbours.
+
+        >>> from tsp_local.threeopt import hexagon
+        >>> TSP.setEdges(hexagon)
+        >>> t = NumpyTwoOpt(range(6), candidates=2)
+        >>> t.heuristic_path = [0, 2, 1, 3, 4, 5]
+        >>> t._optimise()
+        >>> t.heuristic_path, t.heuristic_cost
+        ([0, 1, 2, 3, 4, 5], 6)
+        """
+        path = np.array(self.heuristic_path, dtype=int)
+        size = len(path)
+
+        if size < 4:
+            return
+
+        matrix = self.context.matrix()
+
+        if self.candidates is not None:
+            lists = candidateSet(self.heuristic_path, "nearest",
+                                 self.candidates, self.context)
+            nodes = np.fromiter(lists, dtype=int)
+            neighbours = np.full((matrix.shape[0], self.candidates), -1)
+            for node in nodes:
+                close = [j for j, _ in lists[node]]
+                neighbours[node, :len(close)] = close
+
+        while True:
+            if self.candidates is None:
+                n, m, change = self._improveAll(path, matrix)
+            else:
+                n, m, change = self._improveCandidates(path, matrix,
+                                                       neighbours)
+
+            if change >= -self.epsilon:
+                break
+
+            # Reverse between the two edges, in place
+            path[n + 1:m + 1] = path[n + 1:m + 1][::-1]
+
+        path = path.tolist()
+        self.save(path, self.pathCost(path))
+
+    def _pick(self, change):
+        """
+        Index of the best move, or of the first improving one if fast.
+        """
+        if self.fast:
+            improving = change < -self.epsilon
+            if improving.any():
+                return int(np.argmax(improving))
+
+        return int(np.argmin(change))
+
+    def _improveAll(self, path, matrix):
+        """
+        Gains of every pair of edges (path[n], path[n + 1]) and (path[m],
+        path[m + 1]), the closing edge of the tour included.
+        """
+        size = len(path)
+        a = path
+        b = np.roll(path, -1)
+        removed = matrix[a, b]
+
+        change = matrix[a[:, None], a[None, :]] + matrix[b[:, None], b[None, :]]
+        change -= removed[:, None] + removed[None, :]
+
+        # Only pairs with m >= n + 2 which do not share a node
+        valid = np.triu(np.ones((size, size), dtype=bool), 2)
+        valid[0, size - 1] = False
+        change[~valid] = np.inf
+        self.evaluated += (size - 1) * (size - 2) // 2 - 1
+
+        n, m = divmod(self._pick(change.ravel()), size)
+        return n, m, change[n, m]
+
+    def _improveCandidates(self, path, matrix, neighbours):
+        """
+        Gains of the moves adding an edge from path[n] to one of its
+        candidate neighbours path[m].
+        """
+        size = len(path)
+        position = np.empty(matrix.shape[0], dtype=int)
+        position[path] = np.arange(size)
+
+        close = neighbours[path]
+        n = np.repeat(np.arange(size), close.shape[1])
+        m = position[close.ravel()]
+        known = close.ravel() >= 0
+        n, m = n[known], m[known]
+
+        # Moves are given by the first node of both removed edges
+        n, m = np.minimum(n, m), np.maximum(n, m)
+        keep = (m >= n + 2) & ~((n == 0) & (m == size - 1))
+        n, m = n[keep], m[keep]
+
+        if len(n) == 0:
+            return 0, 0, 0.
+
+        a, c = path[n], path[m]
+        b, d = path[(n + 1) % size], path[(m + 1) % size]
+        change = matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d]
+        self.evaluated += len(change)
+
+        best = self._pick(change)
+        return int(n[best]), int(m[best]), change[best]
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()